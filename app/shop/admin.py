@@ -1,10 +1,15 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.utils.html import format_html
 from wagtail.admin.edit_handlers import FieldPanel, MultiFieldPanel
+from wagtail.contrib.modeladmin.helpers import DjangoORMSearchHandler
 from wagtail.contrib.modeladmin.options import ModelAdmin, modeladmin_register, ModelAdminGroup
+from wagtail.contrib.modeladmin.views import IndexView
 from wagtail.images.edit_handlers import ImageChooserPanel
 
-from .models import Category, Product, Order, OrderItem, StripePayment
+from .export import export_response
+from .models import Category, Product, Order, OrderItem, StripePayment, order_number
+from .pagination import KeysetPage
 
 
 @admin.register(Category)
@@ -18,6 +23,12 @@ class AdminProduct(admin.ModelAdmin):
     list_display = ('code', 'available', 'title', 'slug', 'detail')
     search_fields = ('code', 'title', 'slug', 'detail')
 
+    def get_search_results(self, request, queryset, search_term):
+        # the full text index rather than a scan per search field
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term, ranked=False), False
+
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -30,19 +41,91 @@ class AdminOrder(admin.ModelAdmin):
     list_display = ('id', 'created', 'status', 'first_name', 'last_name',
                     'email', 'address', 'postal_code', 'city', 'updated',)
     search_fields = ('first_name', 'last_name', 'email', 'address', 'city',)
-    list_filter = ('paid_status', 'order_status',)
+    list_filter = ('paid_status', 'order_status', 'dt_created')
     inlines = (OrderItemInline,)
+    show_full_result_count = False
+    actions = ('export_csv', 'export_jsonl')
+
+    @admin.action(description='Export selected orders as CSV')
+    def export_csv(self, request, queryset):
+        return export_response(queryset, 'csv')
+
+    @admin.action(description='Export selected orders as JSON lines')
+    def export_jsonl(self, request, queryset):
+        return export_response(queryset, 'jsonl')
+
+    def get_search_results(self, request, queryset, search_term):
+        # order numbers are looked up directly rather than matched as text
+        if order_number(search_term) is not None:
+            return queryset.search(search_term), False
+        return super().get_search_results(request, queryset, search_term)
 
 
 @admin.register(StripePayment)
 class AdminStripePayment(admin.ModelAdmin):
     list_display = ('id', 'created', 'order_url', 'milestone', 'session_id')
+    list_filter = ('dt_created',)
+    list_select_related = ('order',)
+    search_fields = ('session_id',)
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # payment intent ids and emails are looked up inside the session data
+        matched = queryset.search(search_term)
+        if matched is not None:
+            return matched, False
+        return super().get_search_results(request, queryset, search_term)
 
     def order_url(self, obj):
         order = obj.order
         return format_html(f'<a href="{order.get_absolute_url()}" alt="{order}">{order}</a>')
 
 
+class KeysetIndexView(IndexView):
+    """
+    Index pages read by keyset rather than by offset, with no counts
+
+    Every page of a large table costs the same single query for its rows.
+    Ordering by a column header falls back to the numbered pages.
+    """
+    AFTER_VAR = 'after'
+    BEFORE_VAR = 'before'
+    IGNORED_PARAMS = IndexView.IGNORED_PARAMS + (AFTER_VAR, BEFORE_VAR)
+
+    def key_param(self, name):
+        try:
+            return int(self.request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filters, searches and orderings start again from the first page
+        return super().get_query_string(new_params, [*(remove or ()), self.AFTER_VAR, self.BEFORE_VAR])
+
+    def get_context_data(self, **kwargs):
+        if self.ORDER_VAR in self.params:
+            return super().get_context_data(**kwargs)
+        page = KeysetPage(self.queryset, self.model_admin.keyset_key, self.items_per_page,
+                          after=self.key_param(self.AFTER_VAR), before=self.key_param(self.BEFORE_VAR))
+        context = {
+            'view': self,
+            # only asked of the database when there is nothing to show
+            'all_count': len(page) or self.get_base_queryset().exists(),
+            'keyset_page': page,
+            'object_list': page.object_list,
+            'user_can_create': self.permission_helper.user_can_create(self.request.user),
+            'show_search': self.search_handler.show_search_form,
+            **kwargs,
+        }
+        return super(IndexView, self).get_context_data(**context)
+
+
+class KeysetModelAdmin(ModelAdmin):
+    index_view_class = KeysetIndexView
+    index_template_name = 'shop/admin/keyset_index.html'
+    keyset_key = '-id'
+
+
 class ProductCategoryAdmin(ModelAdmin):
     model = Category
     menu_label = 'Categories'
@@ -60,6 +143,13 @@ class ProductCategoryAdmin(ModelAdmin):
         ])
     ]
 
+class ProductSearchHandler(DjangoORMSearchHandler):
+    def search_queryset(self, queryset, search_term, preserve_order=False, **kwargs):
+        if not search_term or not search_term.strip():
+            return queryset
+        return queryset.search(search_term, ranked=not preserve_order)
+
+
 class ProductsAdmin(ModelAdmin):
     model = Product
     menu_label = 'Products'
@@ -69,6 +159,7 @@ class ProductsAdmin(ModelAdmin):
     exclude_from_explorer = True
     list_display = ('code', 'available', 'title', 'slug', 'detail')
     search_fields = ('code', 'title', 'slug', 'detail')
+    search_handler_class = ProductSearchHandler
 
     panels = [
         MultiFieldPanel([
@@ -76,7 +167,7 @@ class ProductsAdmin(ModelAdmin):
             FieldPanel('code'),
             FieldPanel('title'),
             FieldPanel('detail'),
-            FieldPanel('image'),
+            ImageChooserPanel('image'),
             FieldPanel('price'),
             FieldPanel('available'),
             FieldPanel('shipping'),
@@ -84,8 +175,15 @@ class ProductsAdmin(ModelAdmin):
     ]
 
 
+class OrderSearchHandler(DjangoORMSearchHandler):
+    def search_queryset(self, queryset, search_term, **kwargs):
+        if not search_term or not search_term.strip():
+            return queryset
+        return queryset.search(search_term)
+
+
 # noinspection PyMethodMayBeStatic
-class OrdersAdmin(ModelAdmin):
+class OrdersAdmin(KeysetModelAdmin):
     model = Order
     menu_label = 'Orders'
     menu_icon = 'form'
@@ -93,12 +191,26 @@ class OrdersAdmin(ModelAdmin):
     add_to_settings_menu = False
     exclude_from_explorer = True
     list_display = ('id', 'created', 'url', 'status', 'paid', 'name', 'email', 'total_items', 'total_price')
+    list_filter = ('order_status', 'paid_status', 'dt_created')
     search_fields = ('first_name', 'last_name', 'email')
+    search_handler_class = OrderSearchHandler
+
+    def get_queryset(self, request):
+        # item counts for the whole page in the same query as the orders
+        return super().get_queryset(request).annotate(total_items=Count('items'))
 
     def url(self, order):
         return format_html(f'<a href="{order.get_absolute_url()}" alt="{order}">{order}</a>')
 
-class StripePaymentAdmin(ModelAdmin):
+class StripePaymentSearchHandler(DjangoORMSearchHandler):
+    def search_queryset(self, queryset, search_term, **kwargs):
+        matched = queryset.search(search_term) if search_term else None
+        if matched is not None:
+            return matched
+        return super().search_queryset(queryset, search_term, **kwargs)
+
+
+class StripePaymentAdmin(KeysetModelAdmin):
     model = StripePayment
     menu_label = 'Payments'
     menu_icon = 'success'
@@ -106,7 +218,10 @@ class StripePaymentAdmin(ModelAdmin):
     add_to_settings_menu = False
     exclude_from_explorer = True
     list_display = ('id', 'created', 'order_url', 'action', 'session_id')
-    search_fields = ('dt_created', 'milestone', 'order__id')
+    list_filter = ('milestone', 'dt_created')
+    list_select_related = ('order',)
+    search_fields = ('session_id',)
+    search_handler_class = StripePaymentSearchHandler
 
     def order_url(self, obj):
         order = obj.order
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+JSON cart and checkout endpoints, each answering with the updated cart in the same round trip
+"""
+import json
+from http import HTTPStatus
+
+from django.http import JsonResponse, QueryDict
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_POST, require_GET
+
+from .cart import get_cart, catalog_product, Cart, CartError
+from .forms import CartItemForm, CartLineForm, OrderForm
+from .idempotency import Idempotency
+from .models import Product
+
+__all__ = (
+    'cart_state',
+    'api_cart',
+    'api_cart_add',
+    'api_cart_remove',
+    'api_cart_set',
+    'api_cart_clear',
+    'api_checkout',
+)
+
+
+def cart_state(cart: Cart) -> dict:
+    # lines for products no longer in the catalog are reported and counted as the cart page shows them,
+    # for the customer to remove before checking out
+    return {
+        'items': cart.length,
+        'quantity': cart.total_quantity,
+        'lines': [
+            {
+                'code': line['code'],
+                'title': line['product'].title if line['product'] is not None else None,
+                'available': line['product'] is not None,
+                'quantity': line['quantity'],
+                'price': str(line['price']),
+                'total_price': str(line['total_price']),
+            }
+            for line in cart
+        ],
+        'subtotal': str(cart.lines.subtotal),
+        'shipping': str(cart.shipping_price) if cart.length else '0.00',
+        'total_price': str(cart.total_price) if cart.length else '0.00',
+    }
+
+
+def api_response(data: dict, status=HTTPStatus.OK) -> JsonResponse:
+    response = JsonResponse(data, status=status)
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
+def api_error(message: str, status=HTTPStatus.BAD_REQUEST, **extra) -> JsonResponse:
+    return api_response({'error': message, **extra}, status=status)
+
+
+def request_data(request) -> QueryDict:
+    """form encoded or json bodies alike"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = None
+        query = QueryDict(mutable=True)
+        if isinstance(data, dict):
+            query.update({key: value for key, value in data.items() if value is not None})
+        return query
+    return request.POST
+
+
+@require_GET
+def api_cart(request):
+    return api_response(cart_state(get_cart(request)))
+
+
+@require_POST
+def api_cart_add(request):
+    form = CartItemForm(request_data(request))
+    if not form.is_valid():
+        return api_error('invalid request', errors=form.errors)
+    product = catalog_product(form.cleaned_data['product_code'])
+    if product is None:
+        return api_error('unknown product', status=HTTPStatus.NOT_FOUND)
+    cart = get_cart(request)
+    try:
+        cart.add(product, quantity=form.cleaned_data['product_quantity'])
+    except CartError as e:
+        return api_error(str(e), status=HTTPStatus.CONFLICT, cart=cart_state(cart))
+    return api_response(cart_state(cart))
+
+
+@require_POST
+def api_cart_remove(request):
+    """remove some of a product from the cart, or all of it when no quantity is given"""
+    form = CartLineForm(request_data(request))
+    if not form.is_valid():
+        return api_error('invalid request', errors=form.errors)
+    cart = get_cart(request)
+    code = form.cleaned_data['product_code']
+    if code in cart.cart:
+        # only the code is needed to remove, so no product query
+        cart.remove(Product(code=code), quantity=form.cleaned_data['product_quantity'])
+    return api_response(cart_state(cart))
+
+
+@require_POST
+def api_cart_set(request):
+    """set the quantity of a product in the cart, zero removes it"""
+    form = CartLineForm(request_data(request))
+    if not form.is_valid() or form.cleaned_data['product_quantity'] is None:
+        return api_error('invalid request', errors=form.errors)
+    cart, quantity = get_cart(request), form.cleaned_data['product_quantity']
+    code = form.cleaned_data['product_code']
+    if quantity == 0:
+        if code in cart.cart:
+            cart.remove(Product(code=code))
+        return api_response(cart_state(cart))
+    product = catalog_product(code)
+    if product is None:
+        return api_error('unknown product', status=HTTPStatus.NOT_FOUND)
+    try:
+        cart.add(product, quantity=quantity, update_quantity=True)
+    except CartError as e:
+        return api_error(str(e), status=HTTPStatus.CONFLICT, cart=cart_state(cart))
+    return api_response(cart_state(cart))
+
+
+@require_POST
+def api_cart_clear(request):
+    cart = get_cart(request)
+    cart.clear()
+    return api_response(cart_state(cart))
+
+
+def api_in_progress() -> JsonResponse:
+    return api_error('checkout already in progress', status=HTTPStatus.CONFLICT)
+
+
+@require_POST
+def api_checkout(request):
+    """
+    create the order from the cart, answering with where to pay for it
+
+    Repeats carrying the same idempotency key, as a field or an Idempotency-Key header,
+    are answered with the first order created.
+    """
+    data = request_data(request)
+    return Idempotency(request, 'api-checkout', data=data).respond(lambda: checkout(request, data), conflict=api_in_progress)
+
+
+def checkout(request, data: QueryDict) -> JsonResponse:
+    cart = get_cart(request)
+    if len(cart) < 1:
+        return api_error('There are no products in your shopping cart.')
+    form = OrderForm(data, cart=cart)
+    if not form.is_valid():
+        return api_error('invalid order', errors=form.errors)
+    order = form.save()
+    cart.clear()
+    return api_response({
+        'order_id': order.id,
+        'total_price': str(order.total_price),
+        'payment_url': reverse('payment', args=(order.id,)),
+    }, status=HTTPStatus.CREATED)
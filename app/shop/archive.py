@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Move settled orders, with their items and payments, out of the database into compressed archive files
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Union
+
+from dateutil.tz import tzlocal
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+
+from .models import Order, OrderItem, OrderStatus, Product, StripePayment
+
+__all__ = (
+    'ARCHIVE_STATUSES',
+    'ArchiveError',
+    'archivable_orders',
+    'archive_orders',
+    'restore_order',
+)
+
+# orders that will not change again, paid orders still to be dispatched are kept
+ARCHIVE_STATUSES = (
+    OrderStatus.CANCELLED,
+    OrderStatus.DISPATCHED,
+    OrderStatus.COMPLETED,
+)
+ARCHIVE_NAME = re.compile(r'^orders-(\d+)-(\d+)-(\d+)\.jsonl\.gz$')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """keeps full microsecond precision, which DjangoJSONEncoder truncates to milliseconds"""
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def archive_directory(directory: Union[None, str, Path] = None) -> Path:
+    return Path(directory or settings.ORDER_ARCHIVE_DIR)
+
+
+def archivable_orders(days: int = None, now: datetime = None):
+    days = settings.ORDER_ARCHIVE_DAYS if days is None else days
+    cutoff = (now or datetime.now(tz=tzlocal())) - timedelta(days=days)
+    return Order.objects.filter(dt_created__lt=cutoff, order_status__in=ARCHIVE_STATUSES)
+
+
+def order_record(order: Order) -> str:
+    """one archive line, the order id leads so restore can skip other lines without parsing them"""
+    return json.dumps({
+        'id': order.id,
+        'order': serializers.serialize('python', [order])[0],
+        'items': serializers.serialize('python', order.items.all()),
+        'payments': serializers.serialize('python', order.payments.all()),
+    }, cls=ArchiveEncoder, separators=(',', ':'))
+
+
+def write_archive(directory: Path, orders: list) -> Path:
+    # the timestamp keeps an order archived again after a restore from replacing an earlier file
+    stamp = datetime.now(tz=tzlocal()).strftime('%Y%m%d%H%M%S%f')
+    path = directory / f'orders-{orders[0].id}-{orders[-1].id}-{stamp}.jsonl.gz'
+    partial = path.with_name(f'.{path.name}.partial')
+    with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+        for order in orders:
+            archive.write(order_record(order))
+            archive.write('\n')
+    with open(partial, 'rb') as written:
+        os.fsync(written.fileno())
+    partial.replace(path)
+    return path
+
+
+def archive_orders(days: int = None, directory: Union[None, str, Path] = None, batch_size: int = 500,
+                   limit: int = None) -> int:
+    """
+    archive and delete settled orders older than the retention period, returning the number archived
+
+    Each batch is written to its own file, which is complete on disk before the
+    orders are deleted in the same transaction that locked them.
+    """
+    directory = archive_directory(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        with transaction.atomic():
+            ids = list(archivable_orders(days).order_by('id')
+                       .select_for_update(skip_locked=True).values_list('id', flat=True)[:size])
+            if not ids:
+                break
+            orders = list(Order.objects.filter(id__in=ids).order_by('id').prefetch_related('items', 'payments'))
+            write_archive(directory, orders)
+            StripePayment.objects.filter(order_id__in=ids).delete()
+            OrderItem.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
+        archived += len(ids)
+    return archived
+
+
+def archive_files(directory: Path, order_id: int) -> Iterator[Path]:
+    """archive files whose id range covers the order, most recent first"""
+    candidates = []
+    for path in directory.glob('orders-*.jsonl.gz'):
+        match = ARCHIVE_NAME.match(path.name)
+        if match and int(match[1]) <= order_id <= int(match[2]):
+            candidates.append((match[3], path))
+    return (path for _, path in sorted(candidates, reverse=True))
+
+
+def find_record(directory: Path, order_id: int) -> Union[None, dict]:
+    prefix = f'{{"id":{order_id},'
+    for path in archive_files(directory, order_id):
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                if line.startswith(prefix):
+                    return json.loads(line)
+    return None
+
+
+def restore_order(order_id: int, directory: Union[None, str, Path] = None) -> Order:
+    """put a single archived order back, with its items and payments, exactly as it was archived"""
+    if Order.objects.filter(id=order_id).exists():
+        raise ArchiveError(f'order {order_id} is already present')
+    record = find_record(archive_directory(directory), order_id)
+    if record is None:
+        raise ArchiveError(f'order {order_id} is not in the archive')
+    products = {item['fields']['product'] for item in record['items']}
+    missing = products - set(Product.objects.filter(id__in=products).values_list('id', flat=True))
+    if missing:
+        raise ArchiveError(f'order {order_id} has items of products since deleted: '
+                           f'{", ".join(str(product) for product in sorted(missing))}')
+    try:
+        with transaction.atomic():
+            # raw saves, so timestamps and primary keys are kept as archived
+            for obj in serializers.deserialize('python', [record['order'], *record['items'], *record['payments']]):
+                obj.save()
+    except IntegrityError as e:
+        # such as a product deleted while restoring, the constraints are only checked on commit
+        raise ArchiveError(f'order {order_id} could not be restored: {e}') from e
+    return Order.objects.get(id=order_id)
@@ -1,8 +1,338 @@
 # -*- coding: utf-8 -*-
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
 from django.conf import settings
-from wagtail.core.models import Site
+from django.core import signing
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
 
 from .models import Product, ShopSettings, Order, OrderStatus
+from .utils import to_cents, from_cents, session_exists
+
+
+class CartError(ValueError):
+    pass
+
+
+class CartSerializer:
+    """
+    Compact, versioned session representation of a cart
+
+        "1;CODE1:2:1500;CODE2:1:1900"
+
+    is format version 1 followed by code:quantity:unit price in cents for each line.
+    Sessions holding the original dict of dicts format are upgraded when read.
+    """
+    VERSION = 1
+    MAX_LINES = 50
+    MAX_QUANTITY = 9999
+
+    @classmethod
+    def dumps(cls, cart: dict) -> str:
+        if len(cart) > cls.MAX_LINES:
+            raise CartError(f'A cart is limited to {cls.MAX_LINES} products')
+        lines = (f'{code}:{quantity}:{cents}' for code, (quantity, cents) in cart.items())
+        return ';'.join((str(cls.VERSION), *lines))
+
+    @classmethod
+    def loads(cls, value) -> dict:
+        if isinstance(value, dict):
+            return cls.upgrade(value)
+        if not value or not isinstance(value, str):
+            return {}
+        version, _, body = value.partition(';')
+        if version != str(cls.VERSION):
+            return {}
+        cart = {}
+        for line in body.split(';')[:cls.MAX_LINES] if body else ():
+            try:
+                code, quantity, cents = line.split(':')
+                cart[code] = [min(int(quantity), cls.MAX_QUANTITY), int(cents)]
+            except ValueError:
+                return {}
+        return cart
+
+    @classmethod
+    def upgrade(cls, value: dict) -> dict:
+        """convert the original {code: {'quantity': n, 'price': Decimal}} session format"""
+        cart = {}
+        for code, item in list(value.items())[:cls.MAX_LINES]:
+            try:
+                cart[code] = [min(int(item['quantity']), cls.MAX_QUANTITY), to_cents(item['price'])]
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                continue
+        return cart
+
+
+class CartLines:
+    """
+    Cart contents resolved against the catalog snapshot.
+
+    Products are resolved at most once, without a query while the snapshot
+    is current, and all totals and iteration are derived from the same lines.
+    """
+
+    def __init__(self, cart: dict):
+        # {product code: [quantity, unit price in cents]}
+        self.cart = cart
+
+    @cached_property
+    def products(self) -> dict:
+        if not self.cart:
+            return {}
+        catalog = Product.catalog()
+        return {code: catalog[code].product() for code in self.cart if code in catalog}
+
+    @cached_property
+    def lines(self) -> list:
+        return [
+            dict(code=code, product=self.products.get(code), price=from_cents(cents), quantity=quantity,
+                 total_price=from_cents(cents * quantity))
+            for code, (quantity, cents) in self.cart.items()
+        ]
+
+    @cached_property
+    def unavailable(self) -> list:
+        """codes of products in the cart no longer in the catalog"""
+        return [code for code in self.cart if code not in self.products]
+
+    @cached_property
+    def subtotal(self):
+        return from_cents(sum(cents * quantity for quantity, cents in self.cart.values()))
+
+    @cached_property
+    def quantity(self) -> int:
+        return sum(quantity for quantity, _ in self.cart.values())
+
+    @cached_property
+    def shipping(self) -> bool:
+        return any(line['product'] is not None and line['product'].shipping for line in self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.cart)
+
+
+class SerializedCartStore(ABC):
+    """
+    The whole cart serialized and written back on each change, subclasses say where to
+    """
+
+    @abstractmethod
+    def load(self) -> dict:
+        """the stored cart, empty if there is none"""
+
+    @abstractmethod
+    def clear(self, cart: dict) -> dict:
+        """drop the stored cart, answering with the empty cart"""
+
+    @abstractmethod
+    def save(self, cart: dict) -> dict:
+        """store the cart, answering with it"""
+
+    def add(self, cart: dict, code: str, quantity: int, cents: int, update_quantity=False) -> dict:
+        line = cart.setdefault(code, [0, cents])
+        line[0] = min(quantity if update_quantity else line[0] + quantity, CartSerializer.MAX_QUANTITY)
+        return self.save(cart)
+
+    def remove(self, cart: dict, code: str, quantity=None) -> dict:
+        if quantity is None or quantity >= cart[code][0]:
+            del cart[code]
+        else:
+            cart[code][0] -= quantity
+        return self.save(cart)
+
+
+class SessionCartStore(SerializedCartStore):
+    """
+    The cart serialized into the session
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+
+    @property
+    def deferred(self) -> bool:
+        return settings.CART_DEFER_SESSION and not session_exists(self.session)
+
+    def load(self) -> dict:
+        if self.deferred:
+            # never touched the cart, so leave the session alone until something is added
+            return {}
+        return CartSerializer.loads(self.session.get(settings.CART_SESSION_ID))
+
+    def clear(self, cart: dict) -> dict:
+        if not self.deferred and settings.CART_SESSION_ID in self.session:
+            return self.save({})
+        return cart
+
+    def save(self, cart: dict) -> dict:
+        if cart:
+            self.session[settings.CART_SESSION_ID] = CartSerializer.dumps(cart)
+        else:
+            self.session.pop(settings.CART_SESSION_ID, None)
+        # settings were once copied into every session
+        self.session.pop('shipping', None)
+        self.session.modified = True
+        return cart
+
+
+class RedisCartStore:
+    """
+    Cart lines in a redis hash per session, changed with atomic increments
+
+    Concurrent requests for the same session (double clicks, several tabs) cannot
+    lose each other's changes, and a change writes only the line concerned.
+    The hash holds q:CODE quantity and p:CODE unit price in cents fields, and
+    expires along with the session.
+    """
+    KEY_PREFIX = 'shop:cart:'
+    # takes some off a line, dropping the line when none are left, in one step so no other request comes between
+    DECREMENT = """
+        local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], -tonumber(ARGV[3]))
+        if quantity <= 0 then
+            redis.call('HDEL', KEYS[1], ARGV[1], ARGV[2])
+        end
+        return quantity
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            from django_redis import get_redis_connection
+            self._connection = get_redis_connection(settings.CART_REDIS_ALIAS)
+        return self._connection
+
+    @property
+    def key(self) -> str:
+        return f'{self.KEY_PREFIX}{self.session.session_key}'
+
+    @staticmethod
+    def parse(fields: dict) -> dict:
+        cart = {}
+        for field, value in fields.items():
+            if isinstance(field, bytes):
+                field = field.decode()
+            kind, _, code = field.partition(':')
+            if kind in ('q', 'p'):
+                cart.setdefault(code, [0, 0])[kind == 'p'] = int(value)
+        lines = [(code, [min(quantity, CartSerializer.MAX_QUANTITY), cents])
+                 for code, (quantity, cents) in sorted(cart.items()) if quantity > 0]
+        return dict(lines[:CartSerializer.MAX_LINES])
+
+    def load(self) -> dict:
+        if self.session.session_key is None:
+            return {}
+        return self.parse(self.connection.hgetall(self.key))
+
+    def execute(self, *commands) -> dict:
+        """run the commands as one transaction, answering with the cart as they left it"""
+        if self.session.session_key is None:
+            # the hash is keyed by session, so one is needed from the first change
+            self.session.save()
+        key = self.key
+        with self.connection.pipeline(transaction=True) as pipeline:
+            for command, *args in commands:
+                if isinstance(command, str):
+                    getattr(pipeline, command)(key, *args)
+                else:
+                    command(keys=[key], args=args, client=pipeline)
+            pipeline.expire(key, self.session.get_expiry_age())
+            pipeline.hgetall(key)
+            return self.parse(pipeline.execute()[-1])
+
+    def add(self, cart: dict, code: str, quantity: int, cents: int, update_quantity=False) -> dict:
+        return self.execute(
+            ('hset' if update_quantity else 'hincrby', f'q:{code}', quantity),
+            ('hsetnx', f'p:{code}', cents),
+        )
+
+    def remove(self, cart: dict, code: str, quantity=None) -> dict:
+        if quantity is None or quantity >= cart[code][0]:
+            return self.execute(('hdel', f'q:{code}', f'p:{code}'))
+        # lines changed elsewhere in the meantime keep the difference, or go once none are left
+        decrement = self.connection.register_script(self.DECREMENT)
+        return self.execute((decrement, f'q:{code}', f'p:{code}', quantity))
+
+    def clear(self, cart: dict) -> dict:
+        if self.session.session_key is not None:
+            self.connection.delete(self.key)
+        return {}
+
+
+class CookieCartStore(SerializedCartStore):
+    """
+    The cart in a signed, compressed cookie, so no server state until checkout
+
+    Changes are kept on the store and written to the response by shop.middleware.CartMiddleware.
+    """
+    SALT = 'shop.cart'
+
+    def __init__(self, request):
+        self.cookies = request.COOKIES
+        self.loaded = False
+        self.changed = None
+
+    def load(self) -> dict:
+        self.loaded = True
+        value = self.cookies.get(settings.CART_COOKIE_NAME)
+        if not value:
+            return {}
+        try:
+            return CartSerializer.loads(signing.loads(value, salt=self.SALT, max_age=settings.CART_COOKIE_AGE))
+        except signing.BadSignature:
+            return {}
+
+    def clear(self, cart: dict) -> dict:
+        if settings.CART_COOKIE_NAME in self.cookies:
+            return self.save({})
+        return cart
+
+    def save(self, cart: dict) -> dict:
+        self.changed = cart
+        return cart
+
+    def process_response(self, response):
+        if self.loaded:
+            # the response depends on the cart
+            patch_vary_headers(response, ('Cookie',))
+        if self.changed is None:
+            return
+        if self.changed:
+            value = signing.dumps(CartSerializer.dumps(self.changed), salt=self.SALT, compress=True)
+            response.set_cookie(settings.CART_COOKIE_NAME, value, max_age=settings.CART_COOKIE_AGE,
+                                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+
+
+def cart_store(request):
+    """the storage for carts chosen by settings.CART_STORE"""
+    return import_string(settings.CART_STORE)(request)
+
+
+def catalog_product(code: str, available=True):
+    """the product with this code from the catalog snapshot, None if unknown or not available"""
+    entry = Product.catalog().get(code)
+    if entry is None or (available and not entry.available):
+        return None
+    return entry.product()
+
+
+def get_cart(request) -> 'Cart':
+    """the cart for this request, shared by views and templates"""
+    cart = getattr(request, '_shop_cart', None)
+    if cart is None:
+        cart = request._shop_cart = Cart(request)
+    return cart
 
 
 class Cart:
@@ -12,76 +342,90 @@ class Cart:
 
     def __init__(self, request):
         self.session = request.session
-        self.session['shipping'] = self.shop_settings
+        self.store = cart_store(request)
         self._cart = None
+        self._lines = None
+        self._shop_settings = None
 
     @property
     def shop_settings(self):
-        shop_settings = ShopSettings.for_site(Site.objects.get(is_default_site=True))
-        return {
-            'charge': shop_settings.shipping_charge,
-            'bulk_charge': shop_settings.bulk_shipping_charge,
-            'quantity': shop_settings.bulk_quantity,
-            'tax_rate': shop_settings.tax_rate,
-        }
+        """shipping and tax settings, from the worker wide snapshot"""
+        if self._shop_settings is None:
+            self._shop_settings = ShopSettings.snapshot()
+        return self._shop_settings
 
     @property
-    def cart(self):
+    def cart(self) -> dict:
+        """cart contents as {product code: [quantity, unit price in cents]}"""
         if self._cart is None:
-            self._cart = self.session.get(settings.CART_SESSION_ID, {})
-            if not self._cart:
-                self.session[settings.CART_SESSION_ID] = self._cart
+            self._cart = self.store.load()
         return self._cart
 
+    @property
+    def lines(self) -> CartLines:
+        if self._lines is None:
+            self._lines = CartLines(self.cart)
+        return self._lines
+
     def add(self, product: Product, quantity=1, update_quantity=False):
         if quantity >= 0:
-            if product.code not in self.cart:
-                self.cart[product.code] = dict(quantity=0, price=product.price)
-            if update_quantity:
-                self.cart[product.code]['quantity'] = quantity
-            else:
-                self.cart[product.code]['quantity'] += quantity
-            self.save()
+            if product.code not in self.cart and len(self.cart) >= CartSerializer.MAX_LINES:
+                raise CartError(f'A cart is limited to {CartSerializer.MAX_LINES} products')
+            self.update(self.store.add(self.cart, product.code, quantity, to_cents(product.price), update_quantity))
 
     def remove(self, product, quantity=None):
         if product.code in self.cart:
-            if quantity is None or quantity >= self.cart[product.code]['quantity']:
-                del self.cart[product.code]
-            else:
-                self.cart[product.code]['quantity'] -= quantity
-            self.save()
+            self.update(self.store.remove(self.cart, product.code, quantity))
 
     def clear(self):
-        if settings.CART_SESSION_ID in self.session:
-            del self.session[settings.CART_SESSION_ID]
-            self._cart = None
-            self.save()
+        self.update(self.store.clear(self.cart))
+
+    def update(self, cart: dict):
+        self._cart = cart
+        self._lines = None
 
     @property
     def total_price(self):
-        return sum(item['price'] * item['quantity'] for item in self.cart.values()) + self.shipping_price
+        return self.lines.subtotal + self.shipping_price
 
     @property
     def total_quantity(self):
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.lines.quantity
 
     @property
     def shipping(self):
-        for item in self:
-            if item['product'].shipping:
-                return True
-        return False
+        return self.lines.shipping
+
+    @property
+    def unavailable(self) -> list:
+        return self.lines.unavailable
 
     @property
     def tax_rate(self):
-        return self.session['shipping']['tax_rate']
+        return self.shop_settings['tax_rate']
 
     @property
     def shipping_price(self):
         """wagtail specific basesetting"""
-        total_quantity = self.total_quantity
-        shipping = self.session['shipping']
-        return shipping['charge'] if total_quantity < shipping['quantity'] else shipping['bulk_charge']
+        return self.shipping_charge(self.total_quantity)
+
+    def shipping_charge(self, total_quantity: int) -> Decimal:
+        shipping = self.shop_settings
+        charge = shipping['charge'] if total_quantity < shipping['quantity'] else shipping['bulk_charge']
+        return from_cents(to_cents(charge or 0))
+
+    def summary(self) -> dict:
+        """figures for the cart badge, from the stored cart alone at the prices items were added"""
+        lines = self.cart.values()
+        quantity = sum(line[0] for line in lines)
+        total = from_cents(sum(line[0] * line[1] for line in lines))
+        if lines:
+            total += self.shipping_charge(quantity)
+        return {
+            'items': len(self.cart),
+            'quantity': quantity,
+            'total_price': str(total),
+        }
 
     @property
     def modified(self):
@@ -89,21 +433,13 @@ class Cart:
 
     @property
     def length(self):
-        return len(self.cart.keys())
-
-    def save(self):
-        self.session.modified = True
+        return len(self.cart)
 
     def __iter__(self):
-        cart = self.cart.copy()
-        for product in Product.objects.filter(code__in=list(cart.keys())):
-            cart[product.code]['product'] = product
-        for item in cart.values():
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        return iter(self.lines)
 
     def __len__(self):
-        return len(self.cart.keys())
+        return len(self.cart)
 
 
 class CartOrder:
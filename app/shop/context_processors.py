@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 from django.utils.functional import SimpleLazyObject
 
-from .cart import Cart
+from .cart import get_cart
 
 
 def cart(request):
 
     def _get_cart():
-        return Cart(request)
+        return get_cart(request)
 
     return {
         'cart': SimpleLazyObject(_get_cart)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of orders, with their items and payments, as csv or json lines for accounting
+"""
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+from typing import Iterable, Iterator, Union
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Action, Order, OrderItem, OrderStatus, StripePayment
+
+__all__ = (
+    'EXPORT_FORMATS',
+    'export_orders',
+    'export_lines',
+    'export_response',
+    'filter_orders',
+)
+
+CHUNK_SIZE = 2000
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/jsonl',
+}
+EXPORT_FORMATS = tuple(CONTENT_TYPES)
+ORDER_FIELDS = ('id', 'created', 'status', 'paid', 'first_name', 'last_name', 'email', 'phone', 'address', 'city',
+                'postal_code', 'item_count', 'units', 'items_total', 'shipping', 'tax', 'total_price')
+ITEM_FIELDS = ('product_code', 'product_title', 'price', 'quantity', 'line_total')
+
+
+def filter_orders(queryset=None, date_from: date = None, date_to: date = None, statuses: Iterable[int] = None):
+    """orders created from date_from up to and including date_to, in any of the statuses"""
+    queryset = Order.objects.all() if queryset is None else queryset
+    # days in the site's time zone, as the admin filters and sales rollups count them
+    if date_from:
+        queryset = queryset.filter(dt_created__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        queryset = queryset.filter(
+            dt_created__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)))
+    if statuses:
+        queryset = queryset.filter(order_status__in=list(statuses))
+    return queryset
+
+
+def with_totals(queryset):
+    """item count, units and the sum of the lines for each order, computed by the database"""
+    zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    return queryset.annotate(
+        item_count=Count('items'),
+        units=Coalesce(Sum('items__quantity'), 0),
+        items_total=Coalesce(Sum(F('items__price') * F('items__quantity'),
+                                 output_field=DecimalField(max_digits=12, decimal_places=2)), zero),
+    )
+
+
+class Lookahead:
+    """the next group of rows from a stream ordered by order id, handed over when its order comes up"""
+
+    def __init__(self, rows: Iterator):
+        self.groups = groupby(rows, key=attrgetter('order_id'))
+        self.current = next(self.groups, None)
+
+    def take(self, order_id: int) -> list:
+        while self.current is not None and self.current[0] < order_id:
+            self.current = next(self.groups, None)
+        if self.current is None or self.current[0] != order_id:
+            return []
+        rows = list(self.current[1])
+        self.current = next(self.groups, None)
+        return rows
+
+
+def export_orders(queryset, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    (order, items, payments) for each order, in order id order
+
+    Orders, items and payments are each read through a server side cursor
+    in id order and merged, so only one order's rows are held at a time
+    however many are exported.
+    """
+    ids = queryset.values('id')
+    orders = with_totals(Order.objects.filter(id__in=ids)).order_by('id')
+    items = OrderItem.objects.filter(order__in=ids).select_related('product').order_by('order_id', 'id')
+    payments = StripePayment.objects.filter(order__in=ids).defer('session_data').order_by('order_id', 'id')
+    items = Lookahead(items.iterator(chunk_size=chunk_size))
+    payments = Lookahead(payments.iterator(chunk_size=chunk_size))
+    for order in orders.iterator(chunk_size=chunk_size):
+        yield order, items.take(order.id), payments.take(order.id)
+
+
+def order_record(order: Order) -> dict:
+    return {
+        'id': order.id,
+        'created': order.dt_created,
+        'status': OrderStatus.value_of(order.order_status).label,
+        'paid': order.paid_status,
+        'first_name': order.first_name,
+        'last_name': order.last_name,
+        'email': order.email,
+        'phone': order.phone,
+        'address': order.address,
+        'city': order.city,
+        'postal_code': order.postal_code,
+        'item_count': order.item_count,
+        'units': order.units,
+        'items_total': order.items_total,
+        'shipping': order.shipping,
+        'tax': order.tax,
+        'total_price': order.total_price,
+    }
+
+
+def item_record(item: OrderItem) -> dict:
+    return {
+        'product_code': item.product.code,
+        'product_title': item.product.title,
+        'price': item.price,
+        'quantity': item.quantity,
+        'line_total': item.price_total,
+    }
+
+
+def payment_record(payment: StripePayment) -> dict:
+    return {
+        'session_id': payment.session_id,
+        'action': payment.action,
+        'amount': payment.amount,
+        'created': payment.dt_created,
+    }
+
+
+class Echo:
+    """a file like object handing back what is written, for csv.writer to produce lines one at a time"""
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(exported: Iterator[tuple]) -> Iterator[str]:
+    """one row per order item, each carrying its order and totals, payments summarised on the order"""
+    writer = csv.writer(Echo())
+    yield writer.writerow((*ORDER_FIELDS, *ITEM_FIELDS, 'payments', 'amount_paid'))
+    for order, items, payments in exported:
+        record = order_record(order)
+        record['created'] = record['created'].isoformat()
+        paid = sum((payment.amount for payment in payments if payment.milestone == Action.CONFIRMED),
+                   Decimal('0.00'))
+        # nothing paid yet reads as 0.00, only an order never sent to payment has no amount at all
+        summary = (';'.join(f'{payment.session_id}:{payment.action}' for payment in payments),
+                   paid if payments else '')
+        for item in items or (None,):
+            line = item_record(item) if item else {}
+            yield writer.writerow((*record.values(), *(line.get(field, '') for field in ITEM_FIELDS), *summary))
+
+
+def jsonl_lines(exported: Iterator[tuple]) -> Iterator[str]:
+    """one json object per order with its items and payments nested"""
+    for order, items, payments in exported:
+        record = {
+            **order_record(order),
+            'items': [item_record(item) for item in items],
+            'payments': [payment_record(payment) for payment in payments],
+        }
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_lines(queryset, export_format: str = 'csv', chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'unsupported export format {export_format}')
+    lines = csv_lines if export_format == 'csv' else jsonl_lines
+    return lines(export_orders(queryset, chunk_size=chunk_size))
+
+
+def export_response(queryset, export_format: str = 'csv', filename: Union[None, str] = None) -> StreamingHttpResponse:
+    filename = filename or f'orders-{timezone.localtime():%Y%m%d-%H%M%S}.{export_format}'
+    response = StreamingHttpResponse(export_lines(queryset, export_format), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -7,10 +7,12 @@ from crispy_forms.bootstrap import FormActions
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Row, Div, Layout, Field, Submit
 
+from .idempotency import IDEMPOTENCY_FIELD, new_key
 from .models import Order
 
 __all__ = (
     'CartItemForm',
+    'CartLineForm',
     'OrderForm',
 )
 
@@ -31,6 +33,15 @@ class CartItemForm(forms.Form):
         return quantity
 
 
+class CartLineForm(forms.Form):
+    """a product already in the cart, the quantity is optional and may be zero"""
+    product_code = forms.CharField(label='Product Code', max_length=16)
+    product_quantity = forms.IntegerField(label='Quantity', required=False, min_value=0, max_value=100)
+
+    def clean_product_code(self):
+        return self.cleaned_data['product_code'].upper()[:16]
+
+
 class OrderForm(forms.ModelForm):
     # first_name = forms.CharField(label=_('First Name'), max_length=60)
     # last_name = forms.CharField(label=_('Last Name'), max_length=60)
@@ -40,11 +51,15 @@ class OrderForm(forms.ModelForm):
     # city = forms.CharField(label=_('City'), max_length=100)
     # postal_code = forms.CharField(label=_('Postal Code'), max_length=20)
 
+    # a fresh key each time the form is shown, kept through redisplays with errors
+    idempotency_key = forms.CharField(widget=forms.HiddenInput, required=False, initial=new_key)
+
     def __init__(self, *args, **kwargs):
         self.cart = kwargs.pop('cart', None)
         super().__init__(*args, **kwargs)
         self.helper = FormHelper()
         self.helper.layout = Layout(
+            Field(IDEMPOTENCY_FIELD),
             Div(
                 Field('first_name'),
                 Field('last_name'),
@@ -66,6 +81,13 @@ class OrderForm(forms.ModelForm):
             ),
         )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.cart is not None and self.cart.unavailable:
+            raise ValidationError(_('Some products in your cart are no longer available, please remove them: %s')
+                                  % ', '.join(self.cart.unavailable))
+        return cleaned_data
+
     def save(self, commit=True):
         if commit:
             self.instance.save(cart=self.cart)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Idempotency keys, so a repeated submission replays the response to the first rather than repeating what it did
+"""
+import hashlib
+import re
+import time
+import uuid
+from http import HTTPStatus
+from typing import Callable, Union
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+__all__ = (
+    'IDEMPOTENCY_FIELD',
+    'Idempotency',
+    'new_key',
+)
+
+IDEMPOTENCY_FIELD = 'idempotency_key'
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+KEY_PREFIX = 'shop:idempotency:'
+PENDING = 'pending'
+# how long a key stays claimed by a request that never finishes, such as one whose worker died
+PENDING_TIMEOUT = 120
+POLL_INTERVAL = 0.1
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+def new_key() -> str:
+    return uuid.uuid4().hex
+
+
+def successful(response: HttpResponse) -> bool:
+    return response.status_code < 400
+
+
+def in_progress() -> HttpResponse:
+    return HttpResponse('This request is already being processed.', status=HTTPStatus.CONFLICT,
+                        content_type='text/plain')
+
+
+def freeze(response: HttpResponse) -> tuple:
+    return response.status_code, response.content, {name: response[name] for name in REPLAYED_HEADERS
+                                                    if response.has_header(name)}
+
+
+def thaw(stored: tuple) -> HttpResponse:
+    status, content, headers = stored
+    response = HttpResponse(content, status=status)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+class Idempotency:
+    """
+    a request's idempotency key, from the submitted data or an Idempotency-Key header, scoped to a view and visitor
+
+    The first request with a key claims it and its response is kept for
+    IDEMPOTENCY_TTL seconds; repeats are answered with that response at the
+    cost of one cache read. A repeat arriving while the first is still being
+    handled, as with a double click, waits for it. Requests without a key, or
+    from a visitor with neither a session nor a cart cookie to scope it by,
+    are handled as they always were.
+    """
+    def __init__(self, request, scope: str, data=None):
+        data = request.POST if data is None else data
+        key = data.get(IDEMPOTENCY_FIELD) or request.META.get(IDEMPOTENCY_HEADER)
+        self.key = key if key and KEY_PATTERN.match(key) else None
+        visitor = self.visitor(request)
+        self.cache_key = f'{KEY_PREFIX}{scope}:{visitor}:{self.key}' if visitor and self.key else None
+        self.claimed = False
+
+    @staticmethod
+    def visitor(request) -> Union[None, str]:
+        """the visitor's session, or failing that the cart cookie, which no other visitor can present"""
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            return session.session_key
+        cookie = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        return f'cart-{hashlib.sha256(cookie.encode()).hexdigest()}' if cookie else None
+
+    def derived(self, prefix: str) -> Union[None, str]:
+        """a key for a downstream service, such as stripe, repeated along with this one"""
+        return f'{prefix}-{self.key}' if self.key else None
+
+    def claim(self, conflict: Callable[[], HttpResponse] = in_progress) -> Union[None, HttpResponse]:
+        """None when this request is to be handled, otherwise the response to give instead"""
+        if self.cache_key is None:
+            return None
+        stored = cache.get(self.cache_key)
+        deadline = None
+        while True:
+            if stored is None and cache.add(self.cache_key, PENDING, PENDING_TIMEOUT):
+                self.claimed = True
+                return None
+            if stored is not None and stored != PENDING:
+                return thaw(stored)
+            deadline = deadline or time.monotonic() + settings.IDEMPOTENCY_WAIT
+            if time.monotonic() >= deadline:
+                return conflict()
+            time.sleep(POLL_INTERVAL)
+            stored = cache.get(self.cache_key)
+
+    def finish(self, response: HttpResponse, keep: bool = True) -> HttpResponse:
+        """keep the response for repeats, or release the key so a corrected request can use it"""
+        if self.claimed:
+            if keep:
+                cache.set(self.cache_key, freeze(response), settings.IDEMPOTENCY_TTL)
+            else:
+                self.release()
+        return response
+
+    def release(self):
+        if self.claimed:
+            cache.delete(self.cache_key)
+            self.claimed = False
+
+    def respond(self, handler: Callable[[], HttpResponse], keep: Callable[[HttpResponse], bool] = successful,
+                conflict: Callable[[], HttpResponse] = in_progress) -> HttpResponse:
+        """the handler's response, or the replayed response to the first request with the same key"""
+        replayed = self.claim(conflict)
+        if replayed is not None:
+            return replayed
+        try:
+            response = handler()
+        except BaseException:
+            self.release()
+            raise
+        return self.finish(response, keep=keep(response))
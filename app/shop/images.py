@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Responsive renditions of product images
+"""
+from django.conf import settings
+from django.db.models import Prefetch
+from wagtail.images import get_image_model
+from wagtail.images.models import Filter
+
+__all__ = (
+    'rendition_specs',
+    'prefetch_renditions',
+    'product_renditions',
+)
+
+FORMATS = ('webp', None)
+
+
+def rendition_specs(widths=None, image_format=None) -> list:
+    """filter specs for each width, the original format when image_format is None"""
+    widths = widths or settings.PRODUCT_IMAGE_WIDTHS
+    suffix = f'|format-{image_format}' if image_format else ''
+    return [f'width-{width}{suffix}' for width in widths]
+
+
+def prefetch_renditions(lookup: str = 'image__renditions') -> Prefetch:
+    """prefetch every product rendition the catalog templates use, in one query for the whole page"""
+    specs = [spec for image_format in FORMATS for spec in rendition_specs(image_format=image_format)]
+    Rendition = get_image_model().get_rendition_model()
+    return Prefetch(lookup, queryset=Rendition.objects.filter(filter_spec__in=specs), to_attr='product_renditions')
+
+
+def get_rendition(image, spec: str):
+    prefetched = getattr(image, 'product_renditions', None)
+    if prefetched is not None:
+        image_filter = Filter(spec=spec)
+        cache_key = image_filter.get_cache_key(image)
+        for rendition in prefetched:
+            if rendition.filter_spec == spec and rendition.focal_point_key == cache_key:
+                return rendition
+    # not generated yet, or not prefetched
+    return image.get_rendition(spec)
+
+
+def product_renditions(image, image_format=None, widths=None) -> list:
+    """
+    renditions of the image at each width, largest last
+
+    Images are never upscaled, so widths beyond the original collapse into one rendition.
+    """
+    renditions = {}
+    for spec in rendition_specs(widths, image_format):
+        rendition = get_rendition(image, spec)
+        renditions.setdefault(rendition.width, rendition)
+    return [renditions[width] for width in sorted(renditions)]
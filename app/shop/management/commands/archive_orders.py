@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Move settled orders past the retention period into compressed archive files
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Archive and delete settled orders, with their items and payments, older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Retention period in days, defaults to ORDER_ARCHIVE_DAYS')
+        parser.add_argument('--directory', default=None,
+                            help='Archive directory, defaults to ORDER_ARCHIVE_DIR')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of orders written to each archive file')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after archiving this many orders')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        archived = archive_orders(days=options['days'], directory=options['directory'],
+                                  batch_size=options['batch_size'], limit=options['limit'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Archived {archived} order{"s" if archived != 1 else ""} in {elapsed:.3f}s')
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Stream orders, with their items and payments, to a csv or json lines file for accounting
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.export import EXPORT_FORMATS, CHUNK_SIZE, export_lines, filter_orders
+from shop.models import OrderStatus
+
+
+def status_value(name: str) -> int:
+    try:
+        return OrderStatus[name.upper()]
+    except KeyError:
+        raise CommandError(f'unknown order status {name}, one of {", ".join(s.name.lower() for s in OrderStatus)}')
+
+
+class Command(BaseCommand):
+    help = 'Export orders with their items, payments and totals, optionally by creation date and status'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=None,
+                            help='First day of orders exported, as YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, default=None,
+                            help='Last day of orders exported, as YYYY-MM-DD')
+        parser.add_argument('--status', action='append', default=[],
+                            help='Only orders with this status, such as payment_complete, may be repeated')
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='csv',
+                            help='Export format')
+        parser.add_argument('--output', default=None,
+                            help='File written, the standard output when not given')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        statuses = [status_value(name) for name in options['status']]
+        queryset = filter_orders(date_from=options['date_from'], date_to=options['date_to'], statuses=statuses)
+        started = time.monotonic()
+        output = open(options['output'], 'w', newline='') if options['output'] else None
+        exported = 0
+        try:
+            for line in export_lines(queryset, options['export_format'], chunk_size=options['chunk_size']):
+                if output:
+                    output.write(line)
+                else:
+                    self.stdout.write(line, ending='')
+                exported += 1
+        finally:
+            if output:
+                output.close()
+        elapsed = time.monotonic() - started
+        # the export itself may be on stdout
+        summary = self.stdout if output else self.stderr
+        summary.style_func = None
+        summary.write(f'Exported {exported} line{"s" if exported != 1 else ""} in {elapsed:.3f}s')
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Apply stripe webhook events recorded by the stripe-notify endpoint
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = 'Apply pending stripe webhook events to orders and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of events applied per transaction')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, polling for new events every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        batch_size, interval = options['batch_size'], options['interval']
+        while True:
+            started = time.monotonic()
+            total = failed = 0
+            while True:
+                processed = process_events(batch_size)
+                total += processed.applied
+                failed += processed.failed
+                # a full batch may be followed by more, unless every event in it failed,
+                # when only events already failing are left and they wait for the next run
+                if processed.handled < batch_size or not processed.applied:
+                    break
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Applied {total} event{"s" if total != 1 else ""} in {elapsed:.3f}s'
+                              + (f', {failed} failed' if failed else ''))
+            if interval <= 0:
+                break
+            time.sleep(interval)
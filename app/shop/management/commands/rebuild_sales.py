@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Recompute the daily sales rollups from the orders
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from shop.sales import earliest_rebuild_day, rebuild_sales
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups from paid orders, from a day onwards, ' \
+           'never before the orders that may have been archived'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=None,
+                            help='First day rebuilt, as YYYY-MM-DD, the earliest that can be when not given')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        date_from = max(options['date_from'] or date.min, earliest_rebuild_day())
+        days = rebuild_sales(date_from=date_from)
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Rebuilt {days} day{"s" if days != 1 else ""} of sales from {date_from} in {elapsed:.3f}s')
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Bring a single archived order back into the database
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.archive import ArchiveError, restore_order
+
+
+class Command(BaseCommand):
+    help = 'Restore an archived order, with its items and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_id', type=int, help='Id of the archived order')
+        parser.add_argument('--directory', default=None,
+                            help='Archive directory, defaults to ORDER_ARCHIVE_DIR')
+
+    def handle(self, *args, **options):
+        try:
+            order = restore_order(options['order_id'], directory=options['directory'])
+        except ArchiveError as e:
+            raise CommandError(str(e)) from e
+        self.stdout.write(f'Restored {order} with {order.items.count()} item(s) and '
+                          f'{order.payments.count()} payment(s)')
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Return orders whose payment acceptance has timed out to ready for payment
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Reset orders whose payment acceptance has expired to ready for payment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, sweeping every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            started = time.monotonic()
+            swept = Order.sweep_expired()
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Swept {swept} expired order{"s" if swept != 1 else ""} in {elapsed:.3f}s')
+            if interval <= 0:
+                break
+            time.sleep(interval)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Request middleware for the shop
+"""
+__all__ = (
+    'CartMiddleware',
+)
+
+
+class CartMiddleware:
+    """
+    Lets the cart store act on the response, the cookie store writes the cart here
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_shop_cart', None)
+        process_response = getattr(cart.store, 'process_response', None) if cart is not None else None
+        if process_response is not None:
+            process_response(response)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:16
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+PAYMENT_ACCEPT = 2
+TIMEOUT_PROCESSING = timedelta(minutes=5)
+
+
+def set_expires_at(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.filter(order_status=PAYMENT_ACCEPT).update(expires_at=F('dt_updated') + TIMEOUT_PROCESSING)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_auto_20210216_1401'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('order_status', 2)), fields=['expires_at'], name='shop_order_payment_expiry'),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_order_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_id', models.CharField(help_text='Stripe event id', max_length=255, unique=True)),
+                ('event_type', models.CharField(help_text='Stripe event type', max_length=255)),
+                ('payload', models.JSONField(help_text='Event as received')),
+                ('dt_received', models.DateTimeField(auto_now_add=True, help_text='date and time received')),
+                ('dt_processed', models.DateTimeField(blank=True, help_text='date and time applied', null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text='Failed attempts to apply this event')),
+                ('error', models.TextField(blank=True, default='', help_text='Most recent failure')),
+            ],
+            options={
+                'ordering': ('dt_received',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(condition=models.Q(('dt_processed__isnull', True)), fields=['dt_received'], name='shop_stripeevent_pending'),
+        ),
+    ]
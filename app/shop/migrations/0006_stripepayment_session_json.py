@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:23
+import ast
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+def parse_session_data(text):
+    # the text column held str() of a converted dict, so a python literal rather than json
+    if not text:
+        return None
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return {'raw': text}
+
+
+def text_to_json(apps, schema_editor):
+    StripePayment = apps.get_model('shop', 'StripePayment')
+    payments = StripePayment.objects.exclude(session_text__isnull=True).only('id', 'session_text')
+    batch = []
+    for payment in payments.iterator(chunk_size=500):
+        payment.session_data = parse_session_data(payment.session_text)
+        batch.append(payment)
+        if len(batch) >= 500:
+            StripePayment.objects.bulk_update(batch, ('session_data',))
+            batch = []
+    StripePayment.objects.bulk_update(batch, ('session_data',))
+
+
+def json_to_text(apps, schema_editor):
+    StripePayment = apps.get_model('shop', 'StripePayment')
+    batch = []
+    for payment in StripePayment.objects.exclude(session_data__isnull=True).only('id', 'session_data').iterator():
+        payment.session_text = str(payment.session_data)
+        batch.append(payment)
+    StripePayment.objects.bulk_update(batch, ('session_text',), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_stripeevent'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='stripepayment',
+            old_name='session_data',
+            new_name='session_text',
+        ),
+        migrations.AddField(
+            model_name='stripepayment',
+            name='session_data',
+            field=models.JSONField(blank=True, help_text='Session data', null=True),
+        ),
+        migrations.RunPython(text_to_json, json_to_text),
+        migrations.RemoveField(
+            model_name='stripepayment',
+            name='session_text',
+        ),
+        migrations.AddIndex(
+            model_name='stripepayment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['session_data'], name='shop_stripepayment_session', opclasses=('jsonb_path_ops',)),
+        ),
+    ]
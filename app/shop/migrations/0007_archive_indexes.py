@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_stripepayment_session_json'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['dt_created'], name='shop_order_created'),
+        ),
+        migrations.AddIndex(
+            model_name='stripepayment',
+            index=models.Index(fields=['-dt_created', 'milestone'], name='shop_stripepayment_created'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_archive_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available', 'category', 'code'], name='shop_product_listing'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:40
+import django.db.models.deletion
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def image_size(name):
+    from PIL import Image as PILImage
+    with default_storage.open(name) as image_file:
+        with PILImage.open(image_file) as image:
+            return image.size
+
+
+def files_to_images(apps, schema_editor):
+    """register each uploaded product image with wagtail, leaving the file where it is"""
+    Product = apps.get_model('shop', 'Product')
+    Image = apps.get_model('wagtailimages', 'Image')
+    Collection = apps.get_model('wagtailcore', 'Collection')
+    collection = Collection.objects.filter(depth=1).first()
+    for product in Product.objects.exclude(image_file=''):
+        try:
+            width, height = image_size(product.image_file.name)
+        except (OSError, ValueError):
+            continue  # missing or unreadable, the product is left without an image
+        product.image = Image.objects.create(title=product.title[:255], file=product.image_file.name,
+                                             width=width, height=height, collection=collection)
+        product.save(update_fields=['image'])
+
+
+def images_to_files(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    for product in Product.objects.exclude(image=None).select_related('image'):
+        product.image_file = product.image.file.name
+        product.save(update_fields=['image_file'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0066_collection_management_permissions'),
+        ('wagtailimages', '0023_add_choose_permissions'),
+        ('shop', '0008_product_listing_index'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='product',
+            old_name='image',
+            new_name='image_file',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image',
+            field=models.ForeignKey(blank=True, help_text='An optional image of this product', null=True,
+                                    on_delete=django.db.models.deletion.SET_NULL, related_name='+',
+                                    to='wagtailimages.image'),
+        ),
+        migrations.RunPython(files_to_images, images_to_files),
+        migrations.RemoveField(
+            model_name='product',
+            name='image_file',
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:33
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def build_search_vectors(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    config = settings.SHOP_SEARCH_CONFIG
+    Product.objects.update(search_vector=SearchVector('code', weight='A', config=config) +
+                           SearchVector('title', weight='A', config=config) +
+                           SearchVector('detail', weight='B', config=config))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_wagtail_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shop_product_search'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:51
+
+import django.contrib.postgres.indexes
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.functions.text
+
+
+def trigram_index(field, name):
+    return django.contrib.postgres.indexes.GinIndex(
+        django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(field), name='gin_trgm_ops'),
+        name=name)
+
+
+TRIGRAM_INDEXES = (
+    ('order', trigram_index('first_name', 'shop_order_first_name_trgm')),
+    ('order', trigram_index('last_name', 'shop_order_last_name_trgm')),
+    ('order', trigram_index('email', 'shop_order_email_trgm')),
+    ('stripepayment', trigram_index('session_id', 'shop_payment_session_trgm')),
+)
+
+
+def trigram_installed(cursor) -> bool:
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return cursor.fetchone() is not None
+
+
+def install_trigram(schema_editor) -> bool:
+    """
+    whether pg_trgm is installed, installing it where the server has it and the role may
+
+    Managed servers often ship the extension but refuse CREATE EXTENSION to
+    the migrating role, so it is attempted under a savepoint and any refusal
+    leaves the migration to carry on without it.
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if trigram_installed(cursor):
+            return True
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return False
+        try:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError:
+            return False
+        return True
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """
+    the extension and its indexes, where the server has pg_trgm and it can be installed
+
+    Without it searches are still correct, only unindexed. Once it is installed,
+    migrating back to 0010 and forward again creates the indexes.
+
+    The indexes are not part of the model state, as they may not exist, so
+    Meta.indexes and later autodetected migrations never refer to them. Any
+    later change to them must be written as raw SQL guarded the same way.
+    """
+    if not install_trigram(schema_editor):
+        return
+    for model_name, index in TRIGRAM_INDEXES:
+        schema_editor.add_index(apps.get_model('shop', model_name), index)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    for _, index in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(index.name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stripepayment',
+            index=models.Index(fields=['session_id'], name='shop_stripepayment_session_id'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
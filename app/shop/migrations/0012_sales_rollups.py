@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_trigram_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('units', models.PositiveIntegerField(default=0, help_text='Number of products sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Takings', max_digits=12)),
+                ('day', models.DateField(help_text='Day the orders were placed', unique=True)),
+                ('orders', models.PositiveIntegerField(default=0, help_text='Number of orders')),
+                ('tax', models.DecimalField(decimal_places=2, default=0, help_text='Tax included in revenue', max_digits=12)),
+                ('shipping', models.DecimalField(decimal_places=2, default=0, help_text='Shipping charged', max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+                'ordering': ('-day',),
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(help_text='Day the orders were placed')),
+                ('units', models.PositiveIntegerField(default=0, help_text='Number of products sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Takings', max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+                'ordering': ('-day', 'product'),
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(help_text='Day the orders were placed')),
+                ('units', models.PositiveIntegerField(default=0, help_text='Number of products sold')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Takings', max_digits=12)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.category')),
+            ],
+            options={
+                'verbose_name_plural': 'daily category sales',
+                'ordering': ('-day', 'category'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='shop_dailyproductsales_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category'), name='shop_dailycategorysales_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='stripeevent',
+            name='shop_stripeevent_pending',
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(condition=models.Q(('dt_processed__isnull', True)), fields=['attempts', 'dt_received'], name='shop_stripeevent_pending'),
+        ),
+    ]
@@ -2,20 +2,29 @@
 import re
 from datetime import timedelta, datetime
 from dateutil.tz import tzlocal
-from typing import Union
+from decimal import Decimal
+from typing import NamedTuple, Union
 
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField, SearchVector, SearchQuery, SearchRank
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from wagtail.admin.edit_handlers import FieldPanel
 from wagtail.contrib.settings.models import BaseSetting
 from wagtail.contrib.settings.registry import register_setting
+from wagtail.core.models import Site
 from wagtail.snippets.models import register_snippet
 
+from shop.snapshot import CachedSnapshot
 from shop.utils import convert_to_str
 
 
@@ -39,8 +48,43 @@ class Category(models.Model):
         verbose_name_plural = 'categories'
 
 
+class ProductQuerySet(models.QuerySet):
+
+    def search(self, text: str, ranked: bool = True):
+        """products matching a web search style query, best first unless not ranked, served by the full text index"""
+        query = SearchQuery(text, search_type='websearch', config=settings.SHOP_SEARCH_CONFIG)
+        queryset = self.filter(search_vector=query)
+        if not ranked:
+            return queryset
+        return queryset.annotate(rank=SearchRank(models.F('search_vector'), query)).order_by('-rank', 'code')
+
+    def update_search_vectors(self) -> int:
+        """rebuild the search document of products written without save(), such as by bulk_create"""
+        return self.update(search_vector=Product.search_document())
+
+    # writes that send no save or delete signals still refresh the catalog snapshot, once committed
+
+    def bulk_create(self, *args, **kwargs):
+        result = super().bulk_create(*args, **kwargs)
+        transaction.on_commit(catalog_snapshot.invalidate)
+        return result
+
+    def bulk_update(self, *args, **kwargs):
+        result = super().bulk_update(*args, **kwargs)
+        transaction.on_commit(catalog_snapshot.invalidate)
+        return result
+
+    def update(self, **kwargs):
+        result = super().update(**kwargs)
+        if result:
+            transaction.on_commit(catalog_snapshot.invalidate)
+        return result
+
+
 class Product(models.Model):
     RX_PRODUCT_CODE = re.compile(r'^[A-Za-z0-9\-]+$')
+    # weighted fields making up the full text search document
+    SEARCH_WEIGHTS = (('code', 'A'), ('title', 'A'), ('detail', 'B'))
 
     dt_created = models.DateTimeField(auto_now_add=True)
     dt_updated = models.DateTimeField(auto_now=True)
@@ -52,10 +96,33 @@ class Product(models.Model):
     slug = models.SlugField(max_length=128, unique=True, editable=False,
                             help_text='Unique string that identifies this product in URLs')
     detail = models.TextField(help_text='An optional description of this product', blank=True, default='')
-    image = models.ImageField(upload_to='products/%Y%m', blank=True, help_text='An optional image of this product')
+    # noinspection PyUnresolvedReferences
+    image = models.ForeignKey('wagtailimages.Image', null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='+', help_text='An optional image of this product')
     price = models.DecimalField(max_digits=10, decimal_places=2, help_text='Unit price for this product')
     available = models.BooleanField(default=True, help_text='Is this product available?')
     shipping = models.BooleanField(default=True, help_text='Is there a shipping charge for this product?')
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    @classmethod
+    def search_document(cls, product=None) -> SearchVector:
+        """the weighted search vector, from the columns or from the values of an unsaved product"""
+        config = settings.SHOP_SEARCH_CONFIG
+        vectors = [
+            SearchVector(models.Value(getattr(product, field)) if product else field, weight=weight, config=config)
+            for field, weight in cls.SEARCH_WEIGHTS
+        ]
+        document = vectors[0]
+        for vector in vectors[1:]:
+            document = document + vector
+        return document
+
+    @classmethod
+    def catalog(cls) -> dict:
+        """{code: CatalogEntry} for every product, shared by all requests in this worker"""
+        return catalog_snapshot.get()
 
     def created(self):
         return self.dt_created.replace(microsecond=0, tzinfo=tzlocal()).isoformat(sep=' ')
@@ -69,6 +136,12 @@ class Product(models.Model):
     def save(self, *args, **kwargs):
         self.code = self.code.upper()
         self.slug = slugify(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {field for field, _ in self.SEARCH_WEIGHTS} & set(update_fields):
+            # computed by the database in the same insert or update
+            self.search_vector = self.search_document(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'search_vector'}
         return super().save(*args, **kwargs)
 
     def __str__(self):
@@ -76,11 +149,46 @@ class Product(models.Model):
 
     class Meta:
         ordering = ('code',)
+        indexes = [
+            # catalog pages, available products by category in code order
+            models.Index(fields=('available', 'category', 'code'), name='shop_product_listing'),
+            GinIndex(fields=('search_vector',), name='shop_product_search'),
+        ]
 
 
 register_snippet(Product)
 
 
+class CatalogEntry(NamedTuple):
+    """the product columns carts need, as held in the catalog snapshot"""
+    id: int
+    code: str
+    title: str
+    price: Decimal
+    shipping: bool
+    available: bool
+
+    def product(self) -> Product:
+        """a product instance of its own, so the shared entry is never changed"""
+        return Product(id=self.id, code=self.code, title=self.title, price=self.price, shipping=self.shipping,
+                       available=self.available)
+
+
+def _build_catalog():
+    fields = CatalogEntry._fields
+    return {row[1]: CatalogEntry(*row) for row in Product.objects.order_by().values_list(*fields)}
+
+
+catalog_snapshot = CachedSnapshot('catalog', _build_catalog)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    # after commit, so no worker rebuilds the new generation from rows about to change
+    transaction.on_commit(catalog_snapshot.invalidate)
+
+
 class OrderStatus(models.IntegerChoices):
     UNKNOWN = -2, _('Unknown')
     CANCELLED = -1, _('Cancelled')
@@ -100,6 +208,36 @@ class OrderStatus(models.IntegerChoices):
         return cls.UNKNOWN
 
 
+def order_number(term: str):
+    """the order id in a search term such as 123 or #123, None if it is not one"""
+    term = term.strip().lstrip('#')
+    # only ascii digits, as isdigit() alone takes the likes of '²' that int() refuses
+    return int(term) if term.isascii() and term.isdecimal() else None
+
+
+class OrderQuerySet(models.QuerySet):
+    SEARCH_FIELDS = ('first_name', 'last_name', 'email')
+
+    def search(self, term: str):
+        """
+        orders numbered by the term, otherwise with every word in a name or the email
+        """
+        number = order_number(term)
+        if number is not None:
+            return self.filter(id=number)
+        query = models.Q()
+        for word in term.split():
+            words = models.Q()
+            for field in self.SEARCH_FIELDS:
+                words |= models.Q(**{f'{field}__icontains': word})
+            query &= words
+        return self.filter(query)
+
+    def with_items(self):
+        """orders with their items and each item's product, in two queries however many items there are"""
+        return self.prefetch_related(models.Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+
+
 class Order(models.Model):
 
     TIMEOUT_PROCESSING = timedelta(minutes=5)
@@ -118,12 +256,16 @@ class Order(models.Model):
 
     order_status = models.IntegerField(choices=OrderStatus.choices, default=OrderStatus.NEW_ORDER)
     paid_status = models.BooleanField(default=False)
+    # when accepting payment, the time after which the order reverts to ready
+    expires_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     # total_price includes both of the following components
     shipping = models.DecimalField(max_digits=10, decimal_places=2)
     tax = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    objects = OrderQuerySet.as_manager()
+
     def get_absolute_url(self):
         return reverse('order-detail', args=(self.id,))
 
@@ -156,45 +298,76 @@ class Order(models.Model):
     def updated(self):
         return self.dt_updated.replace(microsecond=0, tzinfo=tzlocal()).isoformat(sep=' ')
 
+    @property
+    def payment_expired(self) -> bool:
+        expires_at = self.expires_at or self.dt_updated + self.TIMEOUT_PROCESSING
+        return datetime.now(tz=tzlocal()) > expires_at
+
     def get_status(self):
-        # fix up some timeod out
-        now = datetime.now(tz=tzlocal())
-        if self.order_status == OrderStatus.PAYMENT_ACCEPT:
-            # accept payment timeout ... reset order
-            expires_at = self.dt_updated + self.TIMEOUT_PROCESSING
-            if now > expires_at:
-                self.set_status(OrderStatus.READY, timestamp=now)
+        # a timed out payment is ready again, whether or not the sweeper has caught up with it
+        if self.order_status == OrderStatus.PAYMENT_ACCEPT and self.payment_expired:
+            return OrderStatus.READY
         return self.order_status
 
     def set_status(self, status: OrderStatus, timestamp: Union[None, datetime]=None):
         updated_at = timestamp if timestamp else datetime.now(tz=tzlocal())
+        # a sale once paid, whatever becomes of the order afterwards, as rebuild_sales counts them
+        paid = self.paid_status and status == OrderStatus.PAYMENT_COMPLETE \
+            and self.order_status != OrderStatus.PAYMENT_COMPLETE
         self.dt_updated = updated_at
         self.order_status = status
-        self.save()
+        self.expires_at = updated_at + self.TIMEOUT_PROCESSING if status == OrderStatus.PAYMENT_ACCEPT else None
+        if not paid:
+            return self.save()
+        from .sales import record_sale  # which imports these models
+        # the sale is counted in the rollups along with the status change, or not at all
+        with transaction.atomic():
+            self.save()
+            record_sale(self)
 
-    @property
-    def total_items(self):
-        return self.items.count()
+    @classmethod
+    def sweep_expired(cls, now: Union[None, datetime]=None) -> int:
+        """return orders whose payment acceptance timed out to ready, in one statement"""
+        now = now if now else datetime.now(tz=tzlocal())
+        return cls.objects.filter(order_status=OrderStatus.PAYMENT_ACCEPT, expires_at__lte=now)\
+            .update(order_status=OrderStatus.READY, expires_at=None, dt_updated=now)
+
+    @cached_property
+    def total_items(self) -> int:
+        """number of items, counted once, from the prefetched items if any, an annotation of the same name replaces it"""
+        items = getattr(self, '_prefetched_objects_cache', {}).get('items')
+        return len(items) if items is not None else self.items.count()
 
     def save(self, **kwargs):
         creating = self.id is None
         cart = kwargs.pop('cart', None)
-        if creating and cart:
-            # fill some additional values from cart
-            self.shipping = cart.shipping_price if cart.shipping else 0.0
-            self.total_price = cart.total_price
-            self.tax = self.total_price / (cart.tax_rate + 1) if cart.tax_rate else 0.0
-        super().save(**kwargs)
-        # create the items
-        if creating and cart:
-            for item in cart:
-                product = item['product']
-                price = item['price']
-                quantity = int(item['quantity'])
-                OrderItem.objects.create(order=self, product=product, price=price, quantity=quantity)
+        if not (creating and cart):
+            return super().save(**kwargs)
+        if cart.unavailable:
+            from .cart import CartError  # which imports these models
+            # the totals include every line, so none may be left out of the order
+            raise CartError(f'No longer available: {", ".join(cart.unavailable)}')
+        # fill some additional values from cart
+        self.shipping = cart.shipping_price if cart.shipping else 0.0
+        self.total_price = cart.total_price
+        self.tax = self.total_price / (cart.tax_rate + 1) if cart.tax_rate else 0.0
+        # the order and all of its items, from the already resolved cart lines
+        with transaction.atomic():
+            super().save(**kwargs)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=self, product=item['product'], price=item['price'], quantity=int(item['quantity']))
+                for item in cart
+            ])
 
     class Meta:
         ordering = ('id',)
+        indexes = [
+            models.Index(fields=('dt_created',), name='shop_order_created'),
+            models.Index(fields=('expires_at',), name='shop_order_payment_expiry',
+                         condition=models.Q(order_status=OrderStatus.PAYMENT_ACCEPT)),
+            # trigram indexes serving icontains on the names and email exist only where pg_trgm could be
+            # installed, so are created by migration 0011 and left out of the model state
+        ]
 
 
 
@@ -215,6 +388,59 @@ class OrderItem(models.Model):
         ordering = ('-order', 'id',)
 
 
+class SalesRollup(models.Model):
+    # a row per day and product outgrows a small integer key within a few years
+    id = models.AutoField(primary_key=True)
+    day = models.DateField(help_text='Day the orders were placed')
+    units = models.PositiveIntegerField(default=0, help_text='Number of products sold')
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text='Takings')
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    """
+    Paid orders per day, revenue being their totals including tax and shipping
+    """
+    day = models.DateField(unique=True, help_text='Day the orders were placed')
+    orders = models.PositiveIntegerField(default=0, help_text='Number of orders')
+    tax = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text='Tax included in revenue')
+    shipping = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text='Shipping charged')
+
+    class Meta:
+        ordering = ('-day',)
+        verbose_name_plural = 'daily sales'
+
+
+class DailyProductSales(SalesRollup):
+    """
+    Paid order items per day and product, revenue being their line totals
+    """
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        ordering = ('-day', 'product')
+        constraints = [
+            models.UniqueConstraint(fields=('day', 'product'), name='shop_dailyproductsales_unique'),
+        ]
+        verbose_name_plural = 'daily product sales'
+
+
+class DailyCategorySales(SalesRollup):
+    """
+    Paid order items per day and product category, revenue being their line totals
+    """
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        ordering = ('-day', 'category')
+        constraints = [
+            models.UniqueConstraint(fields=('day', 'category'), name='shop_dailycategorysales_unique'),
+        ]
+        verbose_name_plural = 'daily category sales'
+
+
 class Action(models.IntegerChoices):
     UNKNOWN = -1, ('unknown')
     CREATED = 0, _('created')
@@ -230,6 +456,33 @@ class Action(models.IntegerChoices):
         return cls.UNKNOWN
 
 
+class StripePaymentQuerySet(models.QuerySet):
+    """
+    Lookups into the recorded session data, all served by the GIN index via containment
+    """
+    def for_payment_intent(self, payment_intent: str):
+        return self.filter(models.Q(session_data__contains={'payment_intent': payment_intent}) |
+                           models.Q(session_data__contains={'payment_intent': {'id': payment_intent}}))
+
+    def for_customer_email(self, email: str):
+        return self.filter(models.Q(session_data__contains={'customer_details': {'email': email}}) |
+                           models.Q(session_data__contains={'customer_email': email}))
+
+    def search(self, term: str):
+        """route a search term to the lookup it looks like, or None if it is not recognised"""
+        term = term.strip()
+        number = order_number(term)
+        if number is not None:
+            return self.filter(order_id=number)
+        if term.startswith('pi_'):
+            return self.for_payment_intent(term)
+        if term.startswith('cs_'):
+            return self.filter(session_id=term)
+        if '@' in term:
+            return self.for_customer_email(term)
+        return None
+
+
 class StripePayment(models.Model):
     """
     This is a simple log of stripe payment transactions
@@ -240,11 +493,13 @@ class StripePayment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2, help_text='Total amount paid')
     session_id = models.TextField(help_text='Transaction session id')
     milestone = models.IntegerField(choices=Action.choices, help_text='Action for this esssion')
-    session_data = models.TextField(blank=True, null=True, help_text='Verbose session data')
+    session_data = models.JSONField(blank=True, null=True, help_text='Session data')
+
+    objects = StripePaymentQuerySet.as_manager()
 
     @classmethod
     def record_action(self, order, session_id, milestone: Action, amount=None, session_data=None):
-        session_data = convert_to_str(session_data)
+        session_data = convert_to_str(session_data, compact=True) or None
         return StripePayment.objects.create(order=order, session_id=session_id,
                                             amount=amount or order.total_price,
                                             milestone=milestone, session_data=session_data)
@@ -261,6 +516,45 @@ class StripePayment(models.Model):
 
     class Meta:
         ordering = ('-dt_created', 'milestone')
+        indexes = [
+            models.Index(fields=('-dt_created', 'milestone'), name='shop_stripepayment_created'),
+            GinIndex(fields=('session_data',), name='shop_stripepayment_session', opclasses=('jsonb_path_ops',)),
+            models.Index(fields=('session_id',), name='shop_stripepayment_session_id'),
+            # and a trigram index on session_id where pg_trgm could be installed, see migration 0011
+        ]
+
+
+class StripeEvent(models.Model):
+    """
+    Stripe webhook events as received, applied later in batches by process_stripe_events
+    """
+    MAX_ATTEMPTS = 5
+
+    id = models.BigAutoField(primary_key=True)
+    event_id = models.CharField(max_length=255, unique=True, help_text='Stripe event id')
+    event_type = models.CharField(max_length=255, help_text='Stripe event type')
+    payload = models.JSONField(help_text='Event as received')
+    dt_received = models.DateTimeField(editable=False, auto_now_add=True, help_text='date and time received')
+    dt_processed = models.DateTimeField(null=True, blank=True, help_text='date and time applied')
+    attempts = models.PositiveSmallIntegerField(default=0, help_text='Failed attempts to apply this event')
+    error = models.TextField(blank=True, default='', help_text='Most recent failure')
+
+    @classmethod
+    def receive(cls, event: dict):
+        """record an event in a single insert, redeliveries of an event already held are ignored"""
+        cls.objects.bulk_create([
+            cls(event_id=event['id'], event_type=event['type'], payload=event)
+        ], ignore_conflicts=True)
+
+    def __str__(self):
+        return f'{self.event_type} {self.event_id}'
+
+    class Meta:
+        ordering = ('dt_received',)
+        indexes = [
+            models.Index(fields=('attempts', 'dt_received'), name='shop_stripeevent_pending',
+                         condition=models.Q(dt_processed__isnull=True)),
+        ]
 
 
 @register_setting
@@ -277,7 +571,31 @@ class ShopSettings(BaseSetting):
         FieldPanel("tax_rate"),
     ]
 
+    @classmethod
+    def snapshot(cls) -> dict:
+        """shipping and tax settings for the default site, shared by all requests in this worker"""
+        return shop_settings_snapshot.get()
+
     def save(self, *args, **kwargs):
-        key = make_template_fragment_key("shop_shipping_settings")
-        cache.delete(key)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        # after commit, so no request caches the settings being replaced again
+        transaction.on_commit(invalidate_shop_settings)
+        return result
+
+
+def invalidate_shop_settings():
+    cache.delete(make_template_fragment_key("shop_shipping_settings"))
+    shop_settings_snapshot.invalidate()
+
+
+def _build_shop_settings():
+    shop_settings = ShopSettings.for_site(Site.objects.get(is_default_site=True))
+    return {
+        'charge': shop_settings.shipping_charge,
+        'bulk_charge': shop_settings.bulk_shipping_charge,
+        'quantity': shop_settings.bulk_quantity,
+        'tax_rate': shop_settings.tax_rate,
+    }
+
+
+shop_settings_snapshot = CachedSnapshot('shop_settings', _build_shop_settings)
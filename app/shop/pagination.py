@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset pagination, each page costs one indexed range query however deep it is
+"""
+from typing import Any
+
+from django.db.models import QuerySet
+
+__all__ = (
+    'KeysetPage',
+)
+
+
+class KeysetPage:
+    """
+    One page of a queryset ordered by a unique key, starting after or ending before a key value
+
+    There is no count and no offset, so the cost of a page does not depend on
+    how many rows precede it. One extra row is fetched to tell whether the
+    page has a neighbour in the direction it was read. A key such as '-id'
+    pages in descending order, "after" then meaning further down the order.
+    """
+    def __init__(self, queryset: QuerySet, key: str, per_page: int, after: Any = None, before: Any = None):
+        self.key = key.lstrip('-')
+        self.per_page = per_page
+        descending = key.startswith('-')
+        forward, backward = ('lt', 'gt') if descending else ('gt', 'lt')
+        reverse = self.key if descending else f'-{self.key}'
+        if before is not None:
+            rows = list(queryset.filter(**{f'{self.key}__{backward}': before}).order_by(reverse)[:per_page + 1])
+            self.has_previous, self.has_next = len(rows) > per_page, True
+            rows = rows[:per_page][::-1]
+        else:
+            if after is not None:
+                queryset = queryset.filter(**{f'{self.key}__{forward}': after})
+            rows = list(queryset.order_by(key)[:per_page + 1])
+            self.has_previous, self.has_next = after is not None, len(rows) > per_page
+            rows = rows[:per_page]
+        self.object_list = rows
+
+    def key_of(self, obj) -> Any:
+        return getattr(obj, self.key)
+
+    @property
+    def next_key(self):
+        return self.key_of(self.object_list[-1]) if self.has_next and self.object_list else None
+
+    @property
+    def previous_key(self):
+        return self.key_of(self.object_list[0]) if self.has_previous and self.object_list else None
+
+    @property
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Daily sales rollups, added to as orders are paid and rebuilt from the orders on demand
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Union
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+
+__all__ = (
+    'earliest_rebuild_day',
+    'record_sale',
+    'rebuild_sales',
+    'sales_summary',
+)
+
+ROLLUPS = (DailySales, DailyProductSales, DailyCategorySales)
+
+
+def line_total():
+    return Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def upsert(model, keys: tuple, rows: list):
+    """
+    add the figures in each row to the rollup row with the same keys, created when missing
+
+    One statement for all rows, each row updated atomically, so concurrent sales never lose a count.
+    """
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = list(rows[0])
+    columns = [quote(model._meta.get_field(field).column) for field in fields]
+    conflict = ', '.join(quote(model._meta.get_field(key).column) for key in keys)
+    updates = ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}'
+                        for field, column in zip(fields, columns) if field not in keys)
+    values = ', '.join(f'({", ".join(["%s"] * len(fields))})' for _ in rows)
+    # a consistent order, so concurrent upserts lock rows in the same sequence
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} ({", ".join(columns)}) VALUES {values} '
+                       f'ON CONFLICT ({conflict}) DO UPDATE SET {updates}',
+                       [row[field] for row in rows for field in fields])
+
+
+def record_sale(order: Order):
+    """add a newly paid order to the rollups of the day it was placed"""
+    day = timezone.localdate(order.dt_created)
+    lines = list(
+        OrderItem.objects.filter(order=order).order_by()
+        .values('product_id', category_id=F('product__category_id'))
+        .annotate(units=Sum('quantity'), revenue=line_total())
+    )
+    categories = {}
+    for line in lines:
+        units, revenue = categories.get(line['category_id'], (0, 0))
+        categories[line['category_id']] = (units + line['units'], revenue + line['revenue'])
+    upsert(DailySales, ('day',), [{
+        'day': day,
+        'orders': 1,
+        'units': sum(line['units'] for line in lines),
+        'revenue': order.total_price,
+        'tax': order.tax,
+        'shipping': order.shipping,
+    }])
+    upsert(DailyProductSales, ('day', 'product'), [
+        {'day': day, 'product': line['product_id'], 'units': line['units'], 'revenue': line['revenue']}
+        for line in lines
+    ])
+    upsert(DailyCategorySales, ('day', 'category'), [
+        {'day': day, 'category': category, 'units': units, 'revenue': revenue}
+        for category, (units, revenue) in categories.items()
+    ])
+
+
+def earliest_rebuild_day() -> date:
+    """the first day none of whose orders can have been archived, the rollups are all that remain of earlier ones"""
+    cutoff = timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_DAYS)
+    return timezone.localdate(cutoff) + timedelta(days=1)
+
+
+def rebuild_sales(date_from: Union[None, date] = None) -> int:
+    """
+    recompute the rollups from the orders, from a day onwards, returning the number of days
+
+    Sales are paid orders whatever has become of them since, as record_sale
+    counts them. Days before earliest_rebuild_day() are never rebuilt, as
+    their orders may have been archived. The rollups are locked against
+    sales being recorded throughout, so none is lost or counted twice.
+    """
+    date_from = max(date_from or date.min, earliest_rebuild_day())
+    orders = Order.objects.filter(paid_status=True,
+                                  dt_created__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    items = OrderItem.objects.filter(order__in=orders).annotate(day=TruncDate('order__dt_created')).order_by()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in ROLLUPS)
+            cursor.execute(f'LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE')
+        for model in ROLLUPS:
+            model.objects.filter(day__gte=date_from).delete()
+        units = dict(items.values('day').annotate(units=Sum('quantity')).values_list('day', 'units'))
+        days = list(
+            orders.annotate(day=TruncDate('dt_created')).order_by().values('day')
+            .annotate(orders=Count('id'), revenue=Sum('total_price'), tax=Sum('tax'), shipping=Sum('shipping'))
+        )
+        products = items.values('day', 'product_id').annotate(units=Sum('quantity'), revenue=line_total())
+        categories = items.values('day', category_id=F('product__category_id'))\
+            .annotate(units=Sum('quantity'), revenue=line_total())
+        DailySales.objects.bulk_create([DailySales(units=units.get(row['day'], 0), **row) for row in days])
+        DailyProductSales.objects.bulk_create([DailyProductSales(**row) for row in products])
+        DailyCategorySales.objects.bulk_create([DailyCategorySales(**row) for row in categories])
+    return len(days)
+
+
+def sales_summary(days: int = 14, top: int = 5) -> dict:
+    """figures for the admin dashboard, from the rollups alone"""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    daily = list(DailySales.objects.filter(day__gte=since))
+    totals = {field: sum(getattr(row, field) for row in daily) for field in ('orders', 'units', 'revenue', 'tax',
+                                                                              'shipping')}
+    products = DailyProductSales.objects.filter(day__gte=since).values('product__code', 'product__title')\
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue', 'product__code')[:top]
+    categories = DailyCategorySales.objects.filter(day__gte=since).values('category__name')\
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue', 'category__name')[:top]
+    return {
+        'days': days,
+        'daily': daily,
+        'totals': totals,
+        'products': list(products),
+        'categories': list(categories),
+    }
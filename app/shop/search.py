@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Ranked full text search over the catalog
+"""
+import hashlib
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+__all__ = (
+    'normalize_query',
+    'search_products',
+)
+
+KEY_PREFIX = 'shop:search:'
+MAX_QUERY_LENGTH = 100
+
+
+def normalize_query(text: str) -> str:
+    return ' '.join((text or '').split())[:MAX_QUERY_LENGTH]
+
+
+def search_products(text: str, page: int = 1) -> Tuple[List[int], bool]:
+    """
+    ids of the available products on a page of results, best match first, and whether there is a next page
+
+    Results are cached for SHOP_SEARCH_CACHE_TTL seconds, so repeated and
+    popular searches are served without ranking the catalog again.
+    """
+    text = normalize_query(text)
+    if not text:
+        return [], False
+    per_page = settings.SHOP_SEARCH_PER_PAGE
+    digest = hashlib.sha1(f'{settings.SHOP_SEARCH_CONFIG}:{text.lower()}'.encode()).hexdigest()
+    key = f'{KEY_PREFIX}{digest}:{page}:{per_page}'
+    results = cache.get(key)
+    if results is None:
+        offset = (page - 1) * per_page
+        ids = list(Product.objects.filter(available=True).search(text)
+                   .values_list('id', flat=True)[offset:offset + per_page + 1])
+        results = (ids[:per_page], len(ids) > per_page)
+        cache.set(key, results, settings.SHOP_SEARCH_CACHE_TTL)
+    return results
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide read-only snapshots of rarely changing data
+"""
+import threading
+import time
+from typing import Any, Callable
+
+from django.core.cache import cache
+
+__all__ = (
+    'CachedSnapshot',
+)
+
+
+class CachedSnapshot:
+    """
+    A value built from the database once per worker process and shared by
+    all requests it serves.
+
+    Staleness is detected via a generation counter held in the shared cache,
+    so a single cache read replaces the database queries on every request and
+    an invalidate() in any worker is seen by all the others.
+    """
+    KEY_PREFIX = 'shop:snapshot:'
+
+    def __init__(self, name: str, builder: Callable[[], Any]):
+        self.name = name
+        self.builder = builder
+        self._lock = threading.RLock()
+        self._generation = None
+        self._value = None
+
+    @property
+    def key(self) -> str:
+        return f'{self.KEY_PREFIX}{self.name}'
+
+    @staticmethod
+    def _new_generation() -> int:
+        # time based, so a flushed cache never resurrects a generation seen earlier
+        return time.time_ns()
+
+    def generation(self) -> int:
+        generation = cache.get(self.key)
+        if generation is None:
+            cache.add(self.key, self._new_generation(), timeout=None)
+            generation = cache.get(self.key)
+        return generation
+
+    def get(self) -> Any:
+        generation = self.generation()
+        with self._lock:
+            if generation is None or generation != self._generation:
+                self._value = self.builder()
+                self._generation = generation
+            return self._value
+
+    def invalidate(self):
+        try:
+            cache.incr(self.key)
+        except ValueError:
+            cache.set(self.key, self._new_generation(), timeout=None)
+        with self._lock:
+            self._generation = None
+            self._value = None
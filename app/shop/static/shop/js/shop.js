@@ -1,5 +1,99 @@
-export const addToCart = (code, title, price) => {
+// Pages are the same for every visitor, the cart badge and csrf tokens are fetched per visitor
+
+const addToCart = (code, title, price) => {
   document.getElementById('product-code').value = code
   document.getElementById('product-title').innerText = title
   document.getElementById('product-price').innerText = '$' + price
 }
+
+const fetchJSON = (url) => fetch(url, {
+  credentials: 'same-origin',
+  headers: {'Accept': 'application/json'}
+}).then((response) => response.json())
+
+const renderBadge = (summary) => {
+  const badge = document.getElementById('cart-summary')
+  if (badge) {
+    badge.querySelector('.cart-items').innerText = `${summary.items} item${summary.items === 1 ? '' : 's'}`
+    badge.querySelector('.cart-total').innerText = `$${summary.total_price}`
+    badge.classList.toggle('d-none', summary.items === 0)
+  }
+}
+
+const showCartSummary = () => {
+  const badge = document.getElementById('cart-summary')
+  if (!badge) {
+    return
+  }
+  fetchJSON(badge.dataset.url)
+    .then(renderBadge)
+    .catch((error) => console.error('cart summary:', error))
+}
+
+// the cart page, updated in place from the state returned by the cart api
+const renderCart = (cart) => {
+  if (cart.items === 0) {
+    // the empty cart is laid out differently, let the server render it
+    window.location.reload()
+    return
+  }
+  const codes = new Set(cart.lines.map((line) => line.code))
+  document.querySelectorAll('[data-cart-line]').forEach((row) => {
+    if (!codes.has(row.dataset.cartLine)) {
+      row.remove()
+    }
+  })
+  cart.lines.forEach((line) => {
+    const row = document.querySelector(`[data-cart-line="${line.code}"]`)
+    if (row) {
+      row.querySelector('.cart-line-quantity').innerText = line.quantity
+      row.querySelector('.cart-line-total').innerText = line.total_price
+      const quantity = row.querySelector('input[name="product_quantity"]')
+      if (quantity) {
+        quantity.value = line.quantity
+      }
+    }
+  })
+  const shipping = document.getElementById('cart-shipping')
+  if (shipping) {
+    shipping.innerText = cart.shipping
+  }
+  document.getElementById('cart-total').innerText = cart.total_price
+  renderBadge(cart)
+}
+
+const submitToApi = (form) => {
+  const data = new FormData(form)
+  fetch(form.dataset.api, {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: {'Accept': 'application/json', 'X-CSRFToken': data.get('csrfmiddlewaretoken')},
+    body: new URLSearchParams(data)
+  })
+    .then((response) => response.ok ? response.json() : Promise.reject(response.status))
+    .then(renderCart)
+    .catch(() => form.submit())
+}
+
+// forms carry an empty token field, filled in from the csrf endpoint on first submit
+document.addEventListener('submit', (event) => {
+  const form = event.target
+  if (form.dataset.api) {
+    event.preventDefault()
+    submitToApi(form)
+    return
+  }
+  const field = form.querySelector('input[name="csrfmiddlewaretoken"][data-csrf-url]')
+  if (!field || field.value) {
+    return
+  }
+  event.preventDefault()
+  fetchJSON(field.dataset.csrfUrl)
+    .then((data) => {
+      field.value = data.token
+      form.submit()
+    })
+    .catch((error) => console.error('csrf token:', error))
+})
+
+showCartSummary()
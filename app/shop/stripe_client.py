@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Stripe API access through a shared, pooled HTTP client
+"""
+import threading
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+__all__ = (
+    'http_client',
+    'configure',
+    'create_checkout_session',
+    'acreate_checkout_session',
+)
+
+_lock = threading.Lock()
+_http_client = None
+
+
+def http_client() -> RequestsClient:
+    """the process wide stripe http client, keeping connections to the API alive between requests"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_client = RequestsClient(
+                timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+                session=session
+            )
+        return _http_client
+
+
+def configure():
+    stripe.default_http_client = http_client()
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_RETRIES
+
+
+def create_checkout_session(**params) -> stripe.checkout.Session:
+    configure()
+    return stripe.checkout.Session.create(api_key=settings.STRIPE_PRIVATE_KEY, **params)
+
+
+async def acreate_checkout_session(**params) -> stripe.checkout.Session:
+    """create a checkout session without blocking the event loop for the round trip"""
+    return await sync_to_async(create_checkout_session, thread_sensitive=False)(**params)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Responsive product images
+"""
+from django import template
+
+from shop.images import product_renditions
+
+register = template.Library()
+
+
+def srcset(renditions) -> str:
+    return ', '.join(f'{rendition.url} {rendition.width}w' for rendition in renditions)
+
+
+@register.inclusion_tag('shop/partials/_product_image.html')
+def product_image(product, sizes='100vw', loading='lazy'):
+    """a picture of the product, webp first, with the original format as the fallback"""
+    image = product.image
+    if image is None:
+        return {'image': None}
+    webp, original = product_renditions(image, 'webp'), product_renditions(image)
+    fallback = original[-1]
+    return {
+        'image': image,
+        'alt': product.code,
+        'sizes': sizes,
+        'loading': loading,
+        'webp_srcset': srcset(webp),
+        'srcset': srcset(original),
+        'fallback': fallback,
+    }
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from shop.models import catalog_snapshot, shop_settings_snapshot
+
+
+@pytest.fixture(autouse=True)
+def fresh_snapshots():
+    """tests roll back rather than commit, so nothing else drops snapshots built from their rows"""
+    catalog_snapshot.invalidate()
+    shop_settings_snapshot.invalidate()
+    yield
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from shop.admin import OrdersAdmin, StripePaymentAdmin
+from shop.models import Category, Order, OrderItem, Product, StripePayment, Action
+
+
+@pytest.fixture
+def admin_client(client, settings):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+    return client
+
+
+@pytest.fixture
+def orders():
+    product = Product.objects.create(category=Category.objects.create(name='Admin'), code='ADM', title='Admin',
+                                     price='2.50')
+
+    def add(count):
+        created = []
+        for _ in range(count):
+            order = Order.objects.create(first_name='First', last_name='Last', email='first@example.com',
+                                         address='1 Street', city='City', postal_code='3000', shipping=0, tax=0,
+                                         total_price='5.00')
+            OrderItem.objects.create(order=order, product=product, price='2.50', quantity=2)
+            StripePayment.record_action(order, f'cs_test_{order.id}', Action.CREATED)
+            created.append(order)
+        return created
+    return add
+
+
+def listing(client, url, **params):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    assert response.status_code == 200
+    shop = [query['sql'] for query in queries if '"shop_' in query['sql']]
+    return response, len(queries), shop
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url', ('/admin/shop/order/', '/admin/shop/stripepayment/'))
+def test_admin_listing_queries(admin_client, orders, url):
+    orders(3)
+    listing(admin_client, url)
+    _, few, shop = listing(admin_client, url)
+    assert len(shop) == 1
+    orders(30)
+    response, more, _ = listing(admin_client, url)
+    assert few == more
+    assert len(response.context['object_list']) == 33
+    assert b'order-detail' not in response.content and b'Order #' in response.content
+
+
+@pytest.mark.django_db
+def test_admin_order_item_counts(admin_client, orders):
+    orders(2)
+    response, _, _ = listing(admin_client, '/admin/shop/order/')
+    assert [order.total_items for order in response.context['object_list']] == [1, 1]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('model_admin, url', ((OrdersAdmin, '/admin/shop/order/'),
+                                              (StripePaymentAdmin, '/admin/shop/stripepayment/')))
+def test_admin_keyset_pages(admin_client, orders, monkeypatch, model_admin, url):
+    monkeypatch.setattr(model_admin, 'list_per_page', 10)
+    ids = [order.id for order in orders(25)][::-1]
+    if model_admin is StripePaymentAdmin:
+        ids = list(StripePayment.objects.order_by('-id').values_list('id', flat=True))
+
+    response, _, _ = listing(admin_client, url)
+    page = response.context['keyset_page']
+    assert [obj.id for obj in page] == ids[:10]
+    response, _, _ = listing(admin_client, url, after=page.next_key)
+    page = response.context['keyset_page']
+    assert [obj.id for obj in page] == ids[10:20]
+    assert f'before={ids[10]}' in response.content.decode()
+    response, _, _ = listing(admin_client, url, before=page.previous_key)
+    assert [obj.id for obj in response.context['keyset_page']] == ids[:10]
+
+    # ordering by a column falls back to numbered pages
+    response, _, _ = listing(admin_client, url, o='0')
+    assert 'keyset_page' not in response.context and response.context['paginator'].count == 25
+
+
+@pytest.mark.django_db
+def test_admin_date_filter(admin_client, orders):
+    orders(2)
+    response, _, _ = listing(admin_client, '/admin/shop/order/', dt_created__gte='2000-01-01')
+    assert len(response.context['object_list']) == 2
+    response, _, _ = listing(admin_client, '/admin/shop/order/', dt_created__lt='2000-01-01')
+    assert list(response.context['object_list']) == []
+    response, _, _ = listing(admin_client, '/django-admin/shop/order/', dt_created__gte='2000-01-01')
+    assert response.context['cl'].result_count == 2
+
+
+@pytest.mark.django_db
+def test_order_search(orders):
+    first, second = orders(2)
+    Order.objects.filter(pk=second.pk).update(first_name='Jane', last_name='Citizen', email='jane@example.org')
+    assert list(Order.objects.search('jane citizen')) == [second]
+    assert list(Order.objects.search('EXAMPLE.ORG')) == [second]
+    assert list(Order.objects.search('first last')) == [first]
+    assert list(Order.objects.search(f'#{first.id}')) == [first]
+    assert list(Order.objects.search('²')) == []
+    assert list(Order.objects.search('9' * 30)) == []
+    assert 'UPPER(' in str(Order.objects.search('jane').query)
+
+
+@pytest.mark.django_db
+def test_admin_search_routing(admin_client, orders):
+    first, second = orders(2)
+    with CaptureQueriesContext(connection) as queries:
+        response, _, _ = listing(admin_client, '/admin/shop/order/', q=str(second.id))
+    assert list(response.context['object_list']) == [second]
+    assert any(f'"shop_order"."id" = {second.id}' in query['sql'] for query in queries)
+
+    response, _, _ = listing(admin_client, '/admin/shop/stripepayment/', q=f'#{first.id}')
+    assert [payment.order_id for payment in response.context['object_list']] == [first.id]
+    response, _, _ = listing(admin_client, '/admin/shop/stripepayment/', q=f'test_{second.id}')
+    assert [payment.order_id for payment in response.context['object_list']] == [second.id]
+
+    response, _, _ = listing(admin_client, '/django-admin/shop/order/', q=str(first.id))
+    assert list(response.context['cl'].result_list) == [first]
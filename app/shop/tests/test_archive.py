@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+import pytest
+from dateutil.tz import tzlocal
+from django.core.management import call_command, CommandError
+
+from shop.archive import archive_orders, restore_order, ArchiveError
+from shop.models import Category, Product, Order, OrderItem, OrderStatus, StripePayment, Action
+
+
+@pytest.fixture
+def product():
+    category = Category.objects.create(name='Archive Tests')
+    return Product.objects.create(category=category, code='ARC1', title='Archived', price='2.50')
+
+
+def make_order(product, status, age_days):
+    order = Order.objects.create(first_name='First', last_name='Last', email='first@example.com', address='1 Street',
+                                 city='City', postal_code='3000', shipping=0, tax=0, total_price='5.00',
+                                 order_status=status)
+    Order.objects.filter(pk=order.pk).update(dt_created=datetime.now(tz=tzlocal()) - timedelta(days=age_days))
+    OrderItem.objects.create(order=order, product=product, price='2.50', quantity=2)
+    StripePayment.record_action(order, f'cs_test_{order.id}', Action.CONFIRMED,
+                                session_data={'object': 'checkout.session', 'payment_intent': f'pi_{order.id}'})
+    return Order.objects.get(pk=order.pk)
+
+
+@pytest.mark.django_db
+def test_archive_orders(product, tmp_path):
+    old = [make_order(product, OrderStatus.COMPLETED, 800) for _ in range(4)]
+    old.append(make_order(product, OrderStatus.DISPATCHED, 800))
+    cancelled = make_order(product, OrderStatus.CANCELLED, 800)
+    unpaid = make_order(product, OrderStatus.READY, 800)
+    undispatched = make_order(product, OrderStatus.PAYMENT_COMPLETE, 800)
+    recent = make_order(product, OrderStatus.COMPLETED, 10)
+
+    assert archive_orders(days=730, directory=tmp_path, batch_size=2) == 6
+    assert len(list(tmp_path.glob('orders-*.jsonl.gz'))) == 3
+    assert set(Order.objects.values_list('id', flat=True)) == {unpaid.id, undispatched.id, recent.id}
+    assert not OrderItem.objects.filter(order_id__in=[o.id for o in old + [cancelled]]).exists()
+    assert StripePayment.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_restore_order(product, tmp_path):
+    orders = [make_order(product, OrderStatus.COMPLETED, 800) for _ in range(3)]
+    archive_orders(days=730, directory=tmp_path)
+    order = orders[1]
+
+    restored = restore_order(order.id, directory=tmp_path)
+    assert (restored.dt_created, restored.dt_updated, restored.total_price) == \
+           (order.dt_created, order.dt_updated, order.total_price)
+    assert [(item.product_id, item.quantity) for item in restored.items.all()] == [(product.id, 2)]
+    assert StripePayment.objects.for_payment_intent(f'pi_{order.id}').get().order_id == order.id
+    assert Order.objects.count() == 1
+
+    with pytest.raises(ArchiveError):
+        restore_order(order.id, directory=tmp_path)
+    with pytest.raises(CommandError):
+        call_command('restore_order', 999999, directory=str(tmp_path))
+
+
+@pytest.mark.django_db
+def test_restore_order_of_deleted_product(product, tmp_path):
+    order = make_order(product, OrderStatus.COMPLETED, 800)
+    archive_orders(days=730, directory=tmp_path)
+    product.delete()
+
+    with pytest.raises(ArchiveError, match='products since deleted'):
+        restore_order(order.id, directory=tmp_path)
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_archive_command(product, tmp_path, capsys):
+    make_order(product, OrderStatus.COMPLETED, 800)
+    call_command('archive_orders', days=730, directory=str(tmp_path))
+    assert 'Archived 1 order in' in capsys.readouterr().out
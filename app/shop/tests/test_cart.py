@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
+import hashlib
 from collections import UserDict
+from decimal import Decimal
 from typing import List
 
 import pytest
-from django.db.models import Manager
+from django.conf import settings
 
-from shop.cart import Cart
-from shop.models import Product, Category
+from shop.cart import Cart, CartError, CartSerializer, RedisCartStore
+from shop.models import CatalogEntry, Product, Category
 
 
 class Session(UserDict):
@@ -16,28 +18,29 @@ class Session(UserDict):
         self.modified = False
 
 
-class Request:
-    def __init__(self):
-        self.session = Session()
+class UntouchableSession(Session):
+    def __getitem__(self, key):
+        raise AssertionError(f'session read {key}')
 
+    def __contains__(self, key):
+        raise AssertionError(f'session read {key}')
 
-class Filter:
-    def __init__(self, items: List[Product]):
-        self.items = items
 
-    def filter(self, **kwargs):
-        for _, v in kwargs.items():     # assumes code__in, [array]
-            return [product for product in self.items if product.code in v]
-        return self.items
+class Request:
+    def __init__(self, session=None):
+        self.session = session if session is not None else Session()
 
-class ProductManager(Manager):
-    model = Product
 
-    def __init__(self, items):
-        self.items = items
+class Catalog:
+    """stands in for the catalog snapshot, counting lookups"""
+    def __init__(self, items: List[Product]):
+        self.entries = {product.code: CatalogEntry(product.id, product.code, product.title, product.price,
+                                                   product.shipping, product.available) for product in items}
+        self.lookups = 0
 
-    def get_queryset(self):
-        return Filter(self.items)
+    def __call__(self):
+        self.lookups += 1
+        return self.entries
 
 
 @pytest.fixture
@@ -147,8 +150,231 @@ def test_cart_clear(cart, products):
 def test_cart_iter(cart, products, monkeypatch):
     cart = populate_cart(cart, products, all=False)
 
-    monkeypatch.setattr(Product, 'objects', ProductManager(products))
+    monkeypatch.setattr(Product, 'catalog', Catalog(products))
 
     for item in cart:
         assert isinstance(item['product'], Product)
         assert item['quantity'] in (1, 2)
+
+
+def test_cart_lines_resolved_once(cart, products, monkeypatch):
+    cart = populate_cart(cart, products, all=False)
+
+    catalog = Catalog(products)
+    monkeypatch.setattr(Product, 'catalog', catalog)
+
+    assert cart.shipping
+    assert [item['quantity'] for item in cart] == [2, 2, 2]
+    assert [item['total_price'] for item in cart] == [38.0, 10.0, 70.0]
+    assert cart.total_price == 118.0
+    assert catalog.lookups == 1
+
+    # mutations invalidate the resolved lines
+    cart.add(products[0])
+    assert len(list(cart)) == 4
+    assert catalog.lookups == 2
+
+
+def test_cart_session_format(cart, products, monkeypatch):
+    cart = populate_cart(cart, products, all=False)
+    monkeypatch.setattr(Product, 'catalog', Catalog(products))
+    list(cart)
+
+    assert cart.session[settings.CART_SESSION_ID] == '1;CODE2:2:1900;CODE4:2:500;CODE6:2:3500'
+
+
+def test_cart_serializer_roundtrip():
+    cart = {'CODE1': [1, 1500], 'CODE-2': [20, 99]}
+    assert CartSerializer.loads(CartSerializer.dumps(cart)) == cart
+    assert CartSerializer.loads(CartSerializer.dumps({})) == {}
+    assert CartSerializer.loads(None) == {}
+    assert CartSerializer.loads('0;CODE1:1:1500') == {}
+    assert CartSerializer.loads('1;CODE1:1') == {}
+
+
+def test_cart_serializer_upgrade():
+    legacy = {
+        'CODE1': {'quantity': 2, 'price': Decimal('15.00')},
+        'CODE2': {'quantity': 1, 'price': Decimal('19.50'), 'product': object(), 'total_price': Decimal('19.50')},
+        'CODE3': {'price': Decimal('1.00')},
+    }
+    assert CartSerializer.loads(legacy) == {'CODE1': [2, 1500], 'CODE2': [1, 1950]}
+
+
+def test_cart_bounded(cart, monkeypatch):
+    monkeypatch.setattr(CartSerializer, 'MAX_LINES', 2)
+    category = Category(name='doesnotmatter')
+    cart.add(Product(category=category, code='CODE1', price=1.00))
+    cart.add(Product(category=category, code='CODE2', price=1.00), quantity=100000)
+    assert cart.total_quantity == 1 + CartSerializer.MAX_QUANTITY
+    with pytest.raises(CartError):
+        cart.add(Product(category=category, code='CODE3', price=1.00))
+    assert len(cart) == 2
+
+
+def test_cart_deferred_session(cart):
+    cart = Cart(request=Request(UntouchableSession()))
+    cart.clear()
+    assert len(cart) == 0
+    assert cart.length == 0
+    assert list(cart) == []
+    assert not cart.modified
+
+
+def test_cart_summary(cart, products, monkeypatch):
+    catalog = Catalog(products)
+    monkeypatch.setattr(Product, 'catalog', catalog)
+    assert cart.summary() == {'items': 0, 'quantity': 0, 'total_price': '0.00'}
+    cart.add(products[0], 2)
+    cart.add(products[3], 9)
+    assert cart.summary() == {'items': 2, 'quantity': 11, 'total_price': '85.00'}
+    # from the session alone, products are never resolved
+    assert catalog.lookups == 0
+
+
+class KeyedSession(Session):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session_key = None
+
+    def save(self):
+        self.session_key = 'session1'
+        self.modified = True
+
+    def get_expiry_age(self):
+        return 600
+
+
+class Redis:
+    """just the hash commands the cart store uses"""
+    def __init__(self):
+        self.hashes = {}
+        self.expiry = {}
+        self.transactions = 0
+
+    def hgetall(self, key):
+        return {field.encode(): str(value).encode() for field, value in self.hashes.get(key, {}).items()}
+
+    def hincrby(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        values[field] = values.get(field, 0) + amount
+        return values[field]
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hsetnx(self, key, field, value):
+        self.hashes.setdefault(key, {}).setdefault(field, value)
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    def expire(self, key, seconds):
+        self.expiry[key] = seconds
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def evalsha(self, sha, numkeys, key, quantity_field, price_field, amount):
+        # RedisCartStore.DECREMENT, the only script the cart store runs
+        quantity = self.hincrby(key, quantity_field, -int(amount))
+        if quantity <= 0:
+            self.hdel(key, quantity_field, price_field)
+        return quantity
+
+    def register_script(self, script):
+        return Script(script)
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Script:
+    def __init__(self, script):
+        assert script == RedisCartStore.DECREMENT
+        self.sha = hashlib.sha1(script.encode()).hexdigest()
+
+    def __call__(self, keys, args, client):
+        return client.evalsha(self.sha, len(keys), *keys, *args)
+
+
+class Pipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, command):
+        return lambda *args: self.commands.append((command, args))
+
+    def execute(self):
+        self.redis.transactions += 1
+        return [getattr(self.redis, command)(*args) for command, args in self.commands]
+
+
+@pytest.fixture
+def redis_cart(cart, settings, monkeypatch):
+    settings.CART_STORE = 'shop.cart.RedisCartStore'
+    redis = Redis()
+    monkeypatch.setattr(RedisCartStore, 'connection', redis)
+    return Cart(request=Request(KeyedSession())), redis
+
+
+def test_redis_cart(redis_cart, products):
+    cart, redis = redis_cart
+    assert len(cart) == 0 and not redis.transactions
+    populate_cart(cart, products)
+    assert cart.session.session_key == 'session1'
+    assert redis.expiry == {'shop:cart:session1': 600}
+    # each change is one transaction, the session itself is never written to
+    assert redis.transactions == len(products)
+    assert settings.CART_SESSION_ID not in cart.session
+
+    cart.remove(products[1], 1)
+    cart.remove(products[3])
+    assert cart.total_quantity == 6
+    assert 'q:CODE4' not in redis.hashes['shop:cart:session1']
+
+    cart.add(products[0], 5, update_quantity=True)
+    assert cart.cart['CODE1'] == [5, 1500]
+    cart.clear()
+    assert len(cart) == 0 and not redis.hashes
+
+
+def test_redis_cart_concurrent(redis_cart, products):
+    """two requests for the same session each see the other's additions"""
+    cart, redis = redis_cart
+    cart.add(products[0])
+    other = Cart(request=Request(cart.session))
+    assert other.cart == {'CODE1': [1, 1500]}
+    cart.add(products[0])
+    other.add(products[0], 2)
+    assert other.cart == {'CODE1': [4, 1500]}
+    assert Cart(request=Request(cart.session)).total_quantity == 4
+
+
+def test_redis_cart_removed_in_two_tabs(redis_cart, products):
+    """a removal judged against a quantity since reduced elsewhere drops the line rather than leaving it negative"""
+    cart, redis = redis_cart
+    cart.add(products[0], 3)
+    other = Cart(request=Request(cart.session))
+    assert other.cart == {'CODE1': [3, 1500]}
+    cart.remove(products[0], 2)
+    other.remove(products[0], 2)
+    assert other.cart == {} and not redis.hashes['shop:cart:session1']
+    other.add(products[0])
+    assert Cart(request=Request(cart.session)).cart == {'CODE1': [1, 1500]}
+    # removed altogether in one tab, then partly in the other
+    cart.add(products[1], 3)
+    other = Cart(request=Request(cart.session))
+    cart.remove(products[1])
+    other.remove(products[1], 1)
+    assert 'q:CODE2' not in redis.hashes['shop:cart:session1']
+    cart.add(products[1])
+    assert Cart(request=Request(cart.session)).cart['CODE2'] == [1, 1900]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from shop.models import Category, Product, Order, ShopSettings
+
+
+@pytest.fixture
+def pages(settings):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+
+
+@pytest.fixture
+def products():
+    category = Category.objects.create(name='Cart API')
+    return [Product.objects.create(category=category, code=f'API{index}', title=f'Product {index}', price='2.50')
+            for index in range(3)]
+
+
+@pytest.fixture
+def shop_settings():
+    # created by the first build, which the second then replaces, all outside the measured requests
+    ShopSettings.snapshot()
+    ShopSettings.snapshot()
+
+
+@pytest.mark.django_db
+def test_shop_settings_refreshed_on_commit(django_capture_on_commit_callbacks):
+    ShopSettings.snapshot()
+    fragment = make_template_fragment_key('shop_shipping_settings')
+    cache.set(fragment, 'shipping')
+    shop_settings = ShopSettings.objects.get()
+    shop_settings.shipping_charge = '12.50'
+    with django_capture_on_commit_callbacks(execute=True):
+        shop_settings.save()
+        # until the save commits, requests keep the settings other workers can still see
+        assert ShopSettings.snapshot()['charge'] != Decimal('12.50')
+        assert cache.get(fragment) == 'shipping'
+    assert ShopSettings.snapshot()['charge'] == Decimal('12.50')
+    assert cache.get(fragment) is None
+
+
+@pytest.mark.django_db
+def test_cart_summary(client, products, shop_settings, django_assert_num_queries):
+    with django_assert_num_queries(0):
+        response = client.get(reverse('cart-summary'))
+    assert response.json() == {'items': 0, 'quantity': 0, 'total_price': '0.00'}
+    assert 'sessionid' not in response.cookies
+    assert 'no-store' in response['Cache-Control'] and 'private' in response['Cache-Control']
+
+    client.post(reverse('cart-add'), {'product_code': 'API1', 'product_quantity': 2})
+    with django_assert_num_queries(0):
+        response = client.get(reverse('cart-summary'))
+    assert response.json() == {'items': 1, 'quantity': 2, 'total_price': '5.00'}
+
+
+@pytest.mark.django_db
+def test_csrf_token(client):
+    response = client.get(reverse('csrf-token'))
+    assert response.json()['token']
+    assert 'csrftoken' in response.cookies
+
+
+@pytest.mark.django_db
+def test_pages_same_for_every_visitor(client, pages, products):
+    anonymous = client.get(reverse('products')).content
+    client.post(reverse('cart-add'), {'product_code': 'API1', 'product_quantity': 2}, follow=True)
+    # once the added to cart message has been shown
+    assert client.get(reverse('products')).content == anonymous
+    assert b'csrfmiddlewaretoken" value=""' in anonymous
+
+
+def order_fields():
+    return dict(first_name='First', last_name='Last', email='first@example.com', address='1 Street',
+                city='City', postal_code='3000')
+
+
+@pytest.mark.django_db
+def test_cart_api(client, products, shop_settings):
+    response = client.post(reverse('api-cart-add'), {'product_code': 'api0', 'product_quantity': 2})
+    assert response.status_code == 200
+    cart = response.json()
+    assert (cart['items'], cart['quantity'], cart['subtotal']) == (1, 2, '5.00')
+    assert cart['lines'] == [{'code': 'API0', 'title': 'Product 0', 'available': True, 'quantity': 2,
+                              'price': '2.50', 'total_price': '5.00'}]
+
+    cart = client.post(reverse('api-cart-add'), {'product_code': 'API1', 'product_quantity': 1},
+                       content_type='application/json').json()
+    assert (cart['items'], cart['quantity'], cart['subtotal']) == (2, 3, '7.50')
+
+    cart = client.post(reverse('api-cart-set'), {'product_code': 'API1', 'product_quantity': 4}).json()
+    assert (cart['quantity'], cart['subtotal']) == (6, '15.00')
+
+    cart = client.post(reverse('api-cart-remove'), {'product_code': 'API1', 'product_quantity': 1}).json()
+    assert cart['quantity'] == 5
+    cart = client.post(reverse('api-cart-remove'), {'product_code': 'API1'}).json()
+    assert [line['code'] for line in cart['lines']] == ['API0']
+
+    cart = client.post(reverse('api-cart-set'), {'product_code': 'API0', 'product_quantity': 0}).json()
+    assert (cart['items'], cart['total_price']) == (0, '0.00')
+
+    assert client.get(reverse('api-cart')).json() == cart
+    assert client.post(reverse('api-cart-clear')).json() == cart
+
+
+@pytest.mark.django_db
+def test_cart_api_errors(client, products):
+    assert client.post(reverse('api-cart-add'), {'product_code': 'NOPE', 'product_quantity': 1}).status_code == 404
+    response = client.post(reverse('api-cart-add'), {'product_code': 'API0', 'product_quantity': 1000})
+    assert response.status_code == 400
+    assert 'product_quantity' in response.json()['errors']
+    assert client.post(reverse('api-cart-set'), {'product_code': 'API0'}).status_code == 400
+    assert client.get(reverse('api-cart-add')).status_code == 405
+
+
+@pytest.mark.django_db
+def test_cart_api_csrf(products):
+    client = Client(enforce_csrf_checks=True)
+    response = client.post(reverse('api-cart-add'), {'product_code': 'API0', 'product_quantity': 1})
+    assert response.status_code == 403
+    token = client.get(reverse('csrf-token')).json()['token']
+    response = client.post(reverse('api-cart-add'), {'product_code': 'API0', 'product_quantity': 1},
+                           HTTP_X_CSRFTOKEN=token)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_checkout_api(client, products):
+    assert client.post(reverse('api-checkout'), order_fields()).status_code == 400
+    client.post(reverse('api-cart-add'), {'product_code': 'API2', 'product_quantity': 3})
+
+    response = client.post(reverse('api-checkout'), {**order_fields(), 'email': 'not an email'})
+    assert response.status_code == 400
+    assert 'email' in response.json()['errors']
+
+    response = client.post(reverse('api-checkout'), order_fields(), content_type='application/json')
+    assert response.status_code == 201
+    result = response.json()
+    order = Order.objects.get(pk=result['order_id'])
+    assert result['payment_url'] == reverse('payment', args=(order.id,))
+    assert [(item.product.code, item.quantity) for item in order.items.all()] == [('API2', 3)]
+    assert client.get(reverse('api-cart')).json()['items'] == 0
+
+
+@pytest.mark.django_db
+def test_checkout_api_idempotent(client, products):
+    client.post(reverse('api-cart-add'), {'product_code': 'API1', 'product_quantity': 1})
+    first = client.post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='checkoutkey')
+    repeat = client.post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='checkoutkey')
+    assert first.status_code == repeat.status_code == 201
+    assert first.json() == repeat.json()
+    assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_checkout_api_idempotent_without_session(settings, products):
+    """cookie carts have no session, keys are kept apart by the cart cookie instead"""
+    settings.CART_STORE = 'shop.cart.CookieCartStore'
+    visitors = [Client(), Client()]
+    for visitor, code in zip(visitors, ('API1', 'API2')):
+        visitor.post(reverse('api-cart-add'), {'product_code': code, 'product_quantity': 1})
+    cart_cookie = visitors[0].cookies[settings.CART_COOKIE_NAME].value
+
+    first = visitors[0].post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='sharedkey')
+    other = visitors[1].post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='sharedkey')
+    assert first.status_code == other.status_code == 201
+    assert first.json()['order_id'] != other.json()['order_id']
+    assert 'sessionid' not in first.cookies
+
+    # a double click sends the same cart cookie again
+    visitors[0].cookies[settings.CART_COOKIE_NAME] = cart_cookie
+    repeat = visitors[0].post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='sharedkey')
+    assert repeat.json() == first.json()
+    # with neither session nor cart the key scopes nothing, and is not honoured
+    stranger = Client().post(reverse('api-checkout'), order_fields(), HTTP_IDEMPOTENCY_KEY='sharedkey')
+    assert stranger.status_code == 400
+    assert Order.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_cookie_cart(client, settings, products, shop_settings):
+    settings.CART_STORE = 'shop.cart.CookieCartStore'
+    response = client.post(reverse('api-cart-add'), {'product_code': 'API1', 'product_quantity': 2})
+    assert response.json()['quantity'] == 2
+    cookie = response.cookies[settings.CART_COOKIE_NAME]
+    assert cookie['httponly'] and cookie['samesite'] == 'Lax'
+    assert 'sessionid' not in response.cookies
+
+    response = client.post(reverse('cart-add'), {'product_code': 'API2', 'product_quantity': 1})
+    assert 'sessionid' not in response.cookies
+    response = client.get(reverse('cart-summary'))
+    assert response.json() == {'items': 2, 'quantity': 3, 'total_price': '7.50'}
+    assert 'Cookie' in response['Vary']
+
+    # tampered carts are discarded
+    value = client.cookies[settings.CART_COOKIE_NAME].value
+    client.cookies[settings.CART_COOKIE_NAME] = value.replace(value[-4:], 'abcd')
+    assert client.get(reverse('api-cart')).json()['items'] == 0
+    client.cookies[settings.CART_COOKIE_NAME] = value
+
+    response = client.post(reverse('api-checkout'), order_fields())
+    assert response.status_code == 201
+    assert Order.objects.get(pk=response.json()['order_id']).total_price
+    assert response.cookies[settings.CART_COOKIE_NAME]['max-age'] == 0
+    assert client.get(reverse('api-cart')).json()['items'] == 0
+
+
+@pytest.mark.django_db
+def test_cart_from_catalog(client, pages, products, shop_settings, django_assert_num_queries,
+                           django_capture_on_commit_callbacks):
+    Product.catalog()
+    with django_assert_num_queries(0):
+        cart = client.post(reverse('api-cart-add'), {'product_code': 'API0', 'product_quantity': 2}).json()
+    assert cart['lines'][0]['title'] == 'Product 0'
+    with django_assert_num_queries(0):
+        response = client.post(reverse('cart-add'), {'product_code': 'API1', 'product_quantity': 1})
+    assert response.status_code == 302
+
+    # saves and deletes are seen once committed
+    with django_capture_on_commit_callbacks(execute=True):
+        products[1].available = False
+        products[1].save()
+    assert client.post(reverse('cart-add'), {'product_code': 'API1', 'product_quantity': 1}).status_code == 404
+    with django_capture_on_commit_callbacks(execute=True):
+        products[2].price = '3.00'
+        products[2].save()
+    cart = client.post(reverse('api-cart-add'), {'product_code': 'API2', 'product_quantity': 1}).json()
+    assert cart['lines'][-1]['price'] == '3.00'
+    with django_capture_on_commit_callbacks(execute=True):
+        products[0].delete()
+    cart = client.get(reverse('api-cart')).json()
+    # a deleted product's line stays, as on the cart page, until the customer removes it
+    assert [(line['code'], line['available']) for line in cart['lines']] == [
+        ('API0', False), ('API1', True), ('API2', True)]
+    assert cart['lines'][0]['title'] is None
+    assert Decimal(cart['subtotal']) == sum(Decimal(line['total_price']) for line in cart['lines'])
+    assert cart['quantity'] == sum(line['quantity'] for line in cart['lines'])
+
+
+@pytest.mark.django_db
+def test_catalog_kept_by_noop_update(products, django_assert_num_queries, django_capture_on_commit_callbacks):
+    Product.catalog()
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        assert Product.objects.filter(code='NOPE').update(available=False) == 0
+    assert not callbacks
+    with django_assert_num_queries(0):
+        Product.catalog()
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(code='API0').update(available=False)
+    with django_assert_num_queries(1):
+        assert not Product.catalog()['API0'].available
+
+
+@pytest.mark.django_db
+def test_catalog_refreshed_on_commit(products, django_assert_num_queries, django_capture_on_commit_callbacks):
+    Product.catalog()
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            Product.objects.filter(code='API0').update(price='3.00')
+            Product.objects.create(category=products[0].category, code='API3', title='Product 3', price='2.50')
+            products[1].delete()
+        # until the writes commit, the catalog is the one other workers can still see
+        with django_assert_num_queries(0):
+            catalog = Product.catalog()
+        assert 'API3' not in catalog and 'API1' in catalog and str(catalog['API0'].price) == '2.50'
+    catalog = Product.catalog()
+    assert 'API3' in catalog and 'API1' not in catalog and str(catalog['API0'].price) == '3.00'
+    # writes that roll back leave it alone
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with pytest.raises(RuntimeError), transaction.atomic():
+            Product.objects.filter(code='API3').delete()
+            raise RuntimeError
+    assert not callbacks
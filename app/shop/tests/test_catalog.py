@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shop.models import Category, Product
+
+
+@pytest.fixture
+def catalog(settings):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    settings.PRODUCTS_PER_PAGE = 10
+    categories = [Category.objects.create(name=name) for name in ('Books', 'Cards')]
+    Product.objects.bulk_create([
+        Product(category=categories[index % 2], code=f'P{index:03}', slug=f'p{index:03}', title=f'Product {index}',
+                price='1.00', available=index != 3)
+        for index in range(45)
+    ])
+    return categories
+
+
+def get_page(client, url, **params):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    assert response.status_code == 200
+    return response, [query['sql'] for query in queries]
+
+
+@pytest.mark.django_db
+def test_product_pages(client, catalog):
+    response, _ = get_page(client, reverse('products'))
+    page = response.context['page']
+    assert [p.code for p in page] == [f'P{index:03}' for index in (0, 1, 2, 4, 5, 6, 7, 8, 9, 10)]
+    assert page.has_next and not page.has_previous
+
+    response, _ = get_page(client, reverse('products'), after=page.next_key)
+    page = response.context['page']
+    assert [p.code for p in page][0] == 'P011'
+    assert page.has_previous
+
+    response, _ = get_page(client, reverse('products'), before=page.previous_key)
+    assert [p.code for p in response.context['page']][-1] == 'P010'
+    assert not response.context['page'].has_previous
+
+
+@pytest.mark.django_db
+def test_category_page_queries(client, catalog):
+    books = catalog[0]
+    # site menus and settings are created on the first request
+    client.get(reverse('products'))
+    response, first = get_page(client, reverse('product-category', args=[books.slug]))
+    page = response.context['page']
+    assert response.context['category'] == books
+    assert all(p.category_id == books.id for p in page)
+    assert len([sql for sql in first if 'FROM "shop_category"' in sql]) == 1
+
+    # a page deep into the catalog costs the same as the first
+    response, last = get_page(client, reverse('product-category', args=[books.slug]), after='P040')
+    assert not response.context['page'].has_next
+    assert len(last) == len(first)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+
 import pytest
+from stripe.stripe_object import StripeObject
 
-from shop.utils import convert_to_str
+from shop.utils import convert_to_str, CONVERT_MAX_DEPTH, CONVERT_MAX_ITEMS, CONVERT_TRUNCATED, CONVERT_CYCLE
 
 
 class SimpleObject:
@@ -73,3 +75,100 @@ def test_convert_to_str(cases, results):
         s = convert_to_str(case)
         assert s == result
 
+
+def test_convert_to_str_no_mutation():
+    obj = SimpleObject(22)
+    convert_to_str(obj)
+    assert '__type__' not in vars(obj)
+
+
+def test_convert_to_str_cycles():
+    obj = VeryComplexObject(66, 22)
+    obj.cobj.parent = obj
+    data = {'a': [1, 2]}
+    data['a'].append(data)
+    assert convert_to_str(obj)['cobj']['parent'] == CONVERT_CYCLE
+    assert convert_to_str(data) == {'a': [1, 2, CONVERT_CYCLE]}
+    # repeated, but not cyclic, references are converted each time
+    shared = SimpleObject(1)
+    assert convert_to_str([shared, shared])[1]['myvalue'] == 31
+
+
+def test_convert_to_str_limits():
+    nested = current = {}
+    for _ in range(50):
+        current['next'] = current = {}
+    depth = 0
+    result = convert_to_str(nested, max_depth=5)
+    while isinstance(result, dict):
+        result, depth = result['next'], depth + 1
+    assert result == CONVERT_TRUNCATED
+    assert depth == 5
+
+    assert convert_to_str(list(range(10)), max_items=5) == [0, 1, 2, 3, CONVERT_TRUNCATED]
+    assert convert_to_str({'a': 1, 'b': 2, 'c': 3}, max_items=3) == {'a': 1, 'b': 2, CONVERT_TRUNCATED: CONVERT_TRUNCATED}
+
+
+def checkout_session(line_items=1000, depth=200):
+    session = StripeObject.construct_from({
+        'id': 'cs_test_1',
+        'object': 'checkout.session',
+        'amount_total': 2500,
+        'currency': 'aud',
+        'customer_details': {'email': 'first@example.com', 'tax_exempt': 'none'},
+        'payment_intent': 'pi_1',
+        'payment_status': 'unpaid',
+        'line_items': {'object': 'list', 'data': [{'id': f'li_{i}', 'amount': i} for i in range(line_items)]},
+    }, 'sk_test')
+    nested = session['metadata'] = {}
+    for _ in range(depth):
+        nested['nested'] = nested = {'padding': list(range(100))}
+    return session
+
+
+def test_convert_to_str_stripe_fields():
+    result = convert_to_str(checkout_session(line_items=5, depth=2))
+    assert result['id'] == 'cs_test_1'
+    assert result['payment_intent'] == 'pi_1'
+    assert result['customer_details'] == {'email': 'first@example.com', 'tax_exempt': 'none'}
+    assert 'line_items' not in result
+
+
+def count_values(data):
+    if isinstance(data, dict):
+        return 1 + sum(count_values(v) for v in data.values())
+    if isinstance(data, list):
+        return 1 + sum(count_values(v) for v in data)
+    return 1
+
+
+def depth_of(data):
+    if isinstance(data, dict):
+        return 1 + max((depth_of(v) for v in data.values()), default=0)
+    if isinstance(data, list):
+        return 1 + max((depth_of(v) for v in data), default=0)
+    return 0
+
+
+class CountedList(list):
+    """counts the elements read from it, the work done on it"""
+    reads = 0
+
+    def __iter__(self):
+        for item in super().__iter__():
+            CountedList.reads += 1
+            yield item
+
+
+def test_convert_to_str_bounded(monkeypatch):
+    """the work done, and the result, are bounded by the caps however large the input"""
+    monkeypatch.setattr(CountedList, 'reads', 0)
+    session = checkout_session(line_items=0, depth=500)
+    session['line_items']['data'] = CountedList({'id': f'li_{i}', 'amount': i} for i in range(20000))
+    session['line_items_copy'] = session['line_items']
+    result = convert_to_str(session, fields={})
+    assert count_values(result) <= CONVERT_MAX_ITEMS + 20
+    assert depth_of(result) <= CONVERT_MAX_DEPTH + 1
+    assert len(str(result)) < 100000
+    # two references to the line items, each read no further than the item cap
+    assert 0 < CountedList.reads <= 2 * (CONVERT_MAX_ITEMS + 1)
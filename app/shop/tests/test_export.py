@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+
+from shop.export import export_lines, filter_orders
+from shop.models import Action, Category, Order, OrderItem, OrderStatus, Product, StripePayment
+
+
+@pytest.fixture
+def orders():
+    category = Category.objects.create(name='Export')
+    products = [Product.objects.create(category=category, code=f'EXP{index}', title=f'Export {index}',
+                                       price='2.50') for index in range(2)]
+
+    def add(count, status=OrderStatus.PAYMENT_COMPLETE, items=2):
+        created = []
+        for _ in range(count):
+            order = Order.objects.create(first_name='First', last_name='Last', email='first@example.com',
+                                         address='1 Street', city='City', postal_code='3000', shipping='1.00',
+                                         tax='0.50', total_price='11.00', order_status=status)
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product, price='2.50', quantity=2)
+                                           for product in products[:items]])
+            StripePayment.record_action(order, f'cs_test_{order.id}', Action.CREATED)
+            if status == OrderStatus.PAYMENT_COMPLETE:
+                StripePayment.record_action(order, f'cs_test_{order.id}', Action.CONFIRMED)
+            created.append(order)
+        return created
+    return add
+
+
+@pytest.mark.django_db
+def test_export_jsonl(orders, django_assert_num_queries):
+    first, second = orders(2)
+    empty, = orders(1, status=OrderStatus.CANCELLED, items=0)
+    with django_assert_num_queries(3):
+        records = [json.loads(line) for line in export_lines(Order.objects.all(), 'jsonl', chunk_size=1)]
+    assert [record['id'] for record in records] == [first.id, second.id, empty.id]
+    record = records[0]
+    assert (record['item_count'], record['units'], record['items_total']) == (2, 4, '10.00')
+    assert [item['product_code'] for item in record['items']] == ['EXP0', 'EXP1']
+    assert [payment['action'] for payment in record['payments']] == ['created', 'confirmed']
+    assert (records[2]['item_count'], records[2]['items_total'], records[2]['items']) == (0, '0.00', [])
+
+
+@pytest.mark.django_db
+def test_export_csv(orders):
+    first, = orders(1)
+    cancelled, = orders(1, status=OrderStatus.CANCELLED, items=0)
+    rows = list(csv.DictReader(io.StringIO(''.join(export_lines(Order.objects.all(), 'csv')))))
+    assert [(row['id'], row['product_code']) for row in rows] == [(str(first.id), 'EXP0'), (str(first.id), 'EXP1'),
+                                                                  (str(cancelled.id), '')]
+    assert rows[0]['items_total'] == '10.00' and rows[0]['line_total'] == '5.00'
+    assert rows[0]['amount_paid'] == '11.00' and rows[2]['amount_paid'] == '0.00'
+    assert rows[2]['status'] == 'Cancelled'
+
+    StripePayment.objects.filter(order=cancelled).delete()
+    rows = list(csv.DictReader(io.StringIO(''.join(export_lines(Order.objects.filter(id=cancelled.id), 'csv')))))
+    assert (rows[0]['payments'], rows[0]['amount_paid']) == ('', '')
+
+
+@pytest.mark.django_db
+def test_export_filters(orders):
+    paid = orders(2)
+    orders(1, status=OrderStatus.CANCELLED)
+    assert list(filter_orders(statuses=[OrderStatus.PAYMENT_COMPLETE])) == paid
+    today = timezone.localdate()
+    assert filter_orders(date_from=today, date_to=today).count() == 3
+    assert not filter_orders(date_to=today - timedelta(days=1)).exists()
+    assert not filter_orders(date_from=today + timedelta(days=1)).exists()
+
+    # late in the evening in the site's time zone is still that day, whatever the server's time zone
+    late = timezone.make_aware(datetime(2026, 1, 5, 23, 30))
+    Order.objects.filter(id=paid[0].id).update(dt_created=late)
+    assert list(filter_orders(date_from=date(2026, 1, 5), date_to=date(2026, 1, 5))) == [paid[0]]
+
+
+@pytest.mark.django_db
+def test_export_command(orders, tmp_path, capsys):
+    orders(2)
+    orders(1, status=OrderStatus.CANCELLED)
+    output = tmp_path / 'orders.jsonl'
+    call_command('export_orders', '--format', 'jsonl', '--status', 'payment_complete', '--output', str(output))
+    assert 'Exported 2 lines in' in capsys.readouterr().out
+    assert len(output.read_text().splitlines()) == 2
+
+    call_command('export_orders', '--from', date.today().isoformat(), '--status', 'cancelled')
+    captured = capsys.readouterr()
+    assert len(captured.out.splitlines()) == 3
+    assert 'Exported 3 lines in' in captured.err
+
+
+@pytest.mark.django_db
+def test_export_admin_action(client, settings, orders):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+    selected = orders(3)[:2]
+    response = client.post('/django-admin/shop/order/', {
+        'action': 'export_jsonl',
+        '_selected_action': [order.id for order in selected],
+    })
+    assert response.streaming
+    assert response['Content-Type'] == 'application/jsonl'
+    assert 'attachment' in response['Content-Disposition']
+    records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [record['id'] for record in records] == [order.id for order in selected]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+import pytest
+from django.core.files.images import ImageFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image as PILImage
+from wagtail.images import get_image_model
+
+from shop.models import Category, Product
+
+
+def make_image(title, width=1200, height=800):
+    buffer = BytesIO()
+    PILImage.new('RGB', (width, height), 'steelblue').save(buffer, 'JPEG')
+    return get_image_model().objects.create(title=title, file=ImageFile(buffer, name=f'{title}.jpg'))
+
+
+@pytest.fixture
+def catalog(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    settings.PRODUCT_IMAGE_WIDTHS = (320, 640, 2000)
+    category = Category.objects.create(name='Images')
+
+    def add(count):
+        start = Product.objects.count()
+        for index in range(start, start + count):
+            Product.objects.create(category=category, code=f'IMG{index}', title=f'Image {index}', price='1.00',
+                                   image=make_image(f'image{index}'))
+    return add
+
+
+def list_page(client):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('products'))
+    return response.content.decode(), len(queries)
+
+
+@pytest.mark.django_db
+def test_product_image_renditions(client, catalog):
+    catalog(1)
+    content, _ = list_page(client)
+    assert '<picture>' in content
+    assert 'type="image/webp"' in content
+    assert '.format-webp.webp 320w' in content and '.format-webp.webp 640w' in content
+    # no upscaling, the original width is the largest offered
+    assert '1200w' in content and '2000w' not in content
+    assert 'width="1200" height="800"' in content
+    assert 'original_images/image0.jpg' not in content
+
+
+@pytest.mark.django_db
+def test_product_image_queries(client, catalog):
+    catalog(2)
+    list_page(client)
+    _, few = list_page(client)
+    catalog(4)
+    list_page(client)
+    _, more = list_page(client)
+    assert few == more
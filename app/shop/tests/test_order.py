@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from dateutil.tz import tzlocal
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shop import views
+from shop.idempotency import Idempotency, IDEMPOTENCY_FIELD
+
+from shop.cart import Cart, CartError
+from shop.forms import OrderForm
+from shop.models import Product, Category, Order, OrderItem, OrderStatus, StripePayment
+from shop.tests.test_cart import Request
+
+
+@pytest.fixture
+def cart(monkeypatch):
+    shop_settings = {
+        'charge': Decimal('5.00'),
+        'bulk_charge': Decimal('10.00'),
+        'quantity': 10,
+        'tax_rate': Decimal('10.00'),
+    }
+    monkeypatch.setattr(Cart, 'shop_settings', shop_settings)
+    return Cart(request=Request())
+
+
+@pytest.fixture
+def category():
+    return Category.objects.create(name='Order Tests')
+
+
+def make_products(category, count):
+    return Product.objects.bulk_create([
+        Product(category=category, code=f'ORD{index}', slug=f'ord{index}', title=f'Product {index}', price='2.50')
+        for index in range(count)
+    ])
+
+
+def order_fields():
+    return dict(first_name='First', last_name='Last', email='first@example.com', address='1 Street',
+                city='City', postal_code='3000')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('count', (1, 40))
+def test_order_from_cart(cart, category, count, django_assert_num_queries):
+    for product in make_products(category, count):
+        cart.add(product, quantity=2)
+
+    # catalog, savepoint + order + items + release
+    with django_assert_num_queries(5):
+        order = Order(**order_fields())
+        order.save(cart=cart)
+
+    assert order.items.count() == count
+    assert order.total_price == Decimal('2.50') * 2 * count + order.shipping
+    assert {item.price for item in OrderItem.objects.filter(order=order)} == {Decimal('2.50')}
+
+
+@pytest.mark.django_db
+def test_order_from_cart_atomic(cart, category, monkeypatch):
+    for product in make_products(category, 3):
+        cart.add(product)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('bulk insert failed')
+
+    monkeypatch.setattr(OrderItem.objects, 'bulk_create', fail)
+    with pytest.raises(RuntimeError):
+        Order(**order_fields()).save(cart=cart)
+    assert not Order.objects.exists()
+
+
+@pytest.mark.django_db
+def test_order_from_cart_with_deleted_product(cart, category):
+    products = make_products(category, 2)
+    for product in products:
+        cart.add(product)
+    products[1].delete()
+    cart.update(cart.cart)
+
+    form = OrderForm(order_fields(), cart=cart)
+    assert not form.is_valid()
+    assert 'ORD1' in form.non_field_errors()[0]
+    # never charged for items left out of the order
+    with pytest.raises(CartError):
+        Order(**order_fields()).save(cart=cart)
+    assert not Order.objects.exists()
+
+    cart.remove(products[1])
+    assert OrderForm(order_fields(), cart=cart).is_valid()
+
+
+@pytest.mark.django_db
+def test_checkout_after_removing_deleted_product(client, settings, category, django_capture_on_commit_callbacks):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    make_products(category, 2)
+    for code in ('ORD0', 'ORD1'):
+        client.post(reverse('cart-add'), {'product_code': code, 'product_quantity': 2})
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.filter(code='ORD1').delete()
+
+    page = client.get(reverse('order')).content.decode()
+    assert 'No longer available' in page and 'name="product_code" value="ORD1"' in page
+    response = client.post(reverse('order'), order_fields())
+    assert response.status_code == 200 and 'ORD1' in response.context['form'].non_field_errors()[0]
+
+    response = client.post(reverse('cart-remove'), {'product_code': 'ORD1', 'product_quantity': 2})
+    assert response.status_code == 302
+    response = client.post(reverse('order'), order_fields())
+    order = Order.objects.get()
+    assert response['Location'] == reverse('payment', args=(order.id,))
+    assert [(item.product.code, item.quantity) for item in order.items.all()] == [('ORD0', 2)]
+
+
+def make_order(**kwargs):
+    return Order.objects.create(shipping=0, tax=0, total_price=10, **order_fields(), **kwargs)
+
+
+@pytest.mark.django_db
+def test_order_status_read_is_pure(django_assert_num_queries):
+    order = make_order()
+    order.set_status(OrderStatus.PAYMENT_ACCEPT, timestamp=datetime.now(tz=tzlocal()) - timedelta(hours=1))
+    assert order.expires_at is not None
+
+    with django_assert_num_queries(0):
+        assert order.get_status() == OrderStatus.READY
+        assert order.can_accept_payment
+    assert Order.objects.get(pk=order.pk).order_status == OrderStatus.PAYMENT_ACCEPT
+
+
+@pytest.mark.django_db
+def test_order_sweep_expired(capsys):
+    now = datetime.now(tz=tzlocal())
+    expired, current, other = make_order(), make_order(), make_order()
+    expired.set_status(OrderStatus.PAYMENT_ACCEPT, timestamp=now - timedelta(hours=1))
+    current.set_status(OrderStatus.PAYMENT_ACCEPT, timestamp=now)
+    other.set_status(OrderStatus.PAYMENT_COMPLETE, timestamp=now - timedelta(hours=1))
+
+    call_command('sweep_orders')
+    assert 'Swept 1 expired order in' in capsys.readouterr().out
+
+    expired.refresh_from_db()
+    assert expired.order_status == OrderStatus.READY
+    assert expired.expires_at is None
+    assert Order.objects.get(pk=current.pk).order_status == OrderStatus.PAYMENT_ACCEPT
+    assert Order.objects.get(pk=other.pk).order_status == OrderStatus.PAYMENT_COMPLETE
+
+
+def make_order_with_items(category, count):
+    order = make_order()
+    OrderItem.objects.bulk_create([OrderItem(order=order, product=product, price=product.price, quantity=2)
+                                   for product in make_products(category, count)])
+    return order
+
+
+def shop_queries(client, url):
+    """queries against shop tables, leaving out those of the cms page around them"""
+    client.get(url)
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return [query['sql'] for query in queries if '"shop_' in query['sql']]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name', ('order-detail', 'payment'))
+def test_order_view_query_budget(client, settings, category, name):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    order = make_order_with_items(category, 12)
+    queries = shop_queries(client, reverse(name, args=(order.id,)))
+    assert len(queries) == 2
+    assert 'shop_product' in queries[1]
+    assert order.total_items == 12
+
+
+@pytest.mark.django_db
+def test_stripe_session_query_budget(client, category, monkeypatch, django_assert_num_queries):
+    order = make_order_with_items(category, 12)
+    sessions = []
+
+    def create_checkout_session(**params):
+        sessions.append(params)
+        return {'id': 'cs_test_budget', 'object': 'checkout.session'}
+
+    monkeypatch.setattr(views, 'create_checkout_session', create_checkout_session)
+    with django_assert_num_queries(4):
+        response = client.post(reverse('stripe-session'), {'orderid': order.id, 'order_amount': '10.00'})
+    assert response.json() == {'status': 'true', 'sessionId': 'cs_test_budget'}
+    assert [item['name'] for item in sessions[0]['line_items']] == [f'Product {index}' for index in range(12)]
+
+
+@pytest.mark.django_db
+def test_order_total_items_counted_once(category, django_assert_num_queries):
+    order = Order.objects.get(pk=make_order_with_items(category, 3).pk)
+    with django_assert_num_queries(1):
+        assert order.total_items == 3
+        assert order.total_items == 3
+
+
+@pytest.fixture
+def checkout_sessions(monkeypatch):
+    sessions = []
+
+    def create_checkout_session(**params):
+        sessions.append(params)
+        return {'id': f'cs_test_{len(sessions)}', 'object': 'checkout.session'}
+
+    monkeypatch.setattr(views, 'create_checkout_session', create_checkout_session)
+    return sessions
+
+
+@pytest.mark.django_db
+def test_order_form_idempotent(client, settings, category):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    make_products(category, 1)
+    client.post(reverse('cart-add'), {'product_code': 'ORD0', 'product_quantity': 2})
+    page = client.get(reverse('order'))
+    key = page.context['form'][IDEMPOTENCY_FIELD].initial
+    assert f'name="{IDEMPOTENCY_FIELD}" value="{key}"' in page.content.decode()
+    assert key and key != client.get(reverse('order')).context['form'][IDEMPOTENCY_FIELD].initial
+
+    # a correctable mistake leaves the key for the corrected submission
+    response = client.post(reverse('order'), {**order_fields(), 'email': 'not an email', IDEMPOTENCY_FIELD: key})
+    assert response.status_code == 200
+    assert response.context['form'][IDEMPOTENCY_FIELD].value() == key
+
+    first = client.post(reverse('order'), {**order_fields(), IDEMPOTENCY_FIELD: key})
+    order = Order.objects.get()
+    assert first.status_code == 302 and first['Location'] == reverse('payment', args=(order.id,))
+    with CaptureQueriesContext(connection) as queries:
+        repeat = client.post(reverse('order'), {**order_fields(), IDEMPOTENCY_FIELD: key})
+    assert (repeat.status_code, repeat['Location']) == (302, first['Location'])
+    assert not queries
+    assert Order.objects.count() == 1
+
+    # a new key is a new order
+    client.post(reverse('cart-add'), {'product_code': 'ORD0', 'product_quantity': 1})
+    client.post(reverse('order'), {**order_fields(), IDEMPOTENCY_FIELD: 'anotherkey'})
+    assert Order.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_stripe_session_idempotent(client, category, checkout_sessions):
+    order = make_order_with_items(category, 2)
+    # keys are scoped by the visitor's session, which shopping has given them
+    client.post(reverse('cart-add'), {'product_code': 'ORD0', 'product_quantity': 1})
+    data = {'orderid': order.id, 'order_amount': '10.00', IDEMPOTENCY_FIELD: 'paymentkey'}
+    first = client.post(reverse('stripe-session'), data)
+    with CaptureQueriesContext(connection) as queries:
+        repeat = client.post(reverse('stripe-session'), data)
+    assert first.json() == repeat.json() == {'status': 'true', 'sessionId': 'cs_test_1'}
+    assert not queries
+    assert [params['idempotency_key'] for params in checkout_sessions] == [f'checkout-{order.id}-paymentkey']
+    assert StripePayment.objects.filter(order=order).count() == 1
+
+    # without a key each request is handled, as before
+    client.post(reverse('stripe-session'), {'orderid': order.id, 'order_amount': '10.00'})
+    assert checkout_sessions[-1]['idempotency_key'] is None
+    assert StripePayment.objects.filter(order=order).count() == 2
+
+
+@pytest.mark.django_db
+def test_stripe_session_in_progress(client, settings, category, checkout_sessions, rf):
+    settings.IDEMPOTENCY_WAIT = 0.2
+    order = make_order_with_items(category, 1)
+    data = {'orderid': order.id, 'order_amount': '10.00', IDEMPOTENCY_FIELD: 'pendingkey'}
+    session = SessionStore()
+    session.create()
+
+    def post(data):
+        request = rf.post(reverse('stripe-session'), data)
+        request.session = session
+        return request
+
+    assert Idempotency(post(data), 'stripe-session').claim() is None
+    response = views.stripe_session(post(data))
+    assert response.status_code == 409
+    assert not checkout_sessions
+
+    # an invalid request releases its key
+    cache.clear()
+    assert views.stripe_session(post({**data, 'order_amount': '1.00'})).status_code == 400
+    assert views.stripe_session(post(data)).status_code == 200
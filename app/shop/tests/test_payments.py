@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import importlib
+
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from shop.models import Order, StripePayment, Action
+
+
+def checkout_session(session_id, payment_intent, email):
+    return {
+        'id': session_id,
+        'object': 'checkout.session',
+        'payment_intent': payment_intent,
+        'payment_status': 'paid',
+        'customer_details': {'email': email, 'phone': None, 'tax_ids': []},
+        'customer_email': None,
+        'line_items': {'data': ['dropped']},
+    }
+
+
+@pytest.fixture
+def order():
+    return Order.objects.create(first_name='First', last_name='Last', email='first@example.com', address='1 Street',
+                                city='City', postal_code='3000', shipping=0, tax=0, total_price='25.00')
+
+
+@pytest.fixture
+def payments(order):
+    return [
+        StripePayment.record_action(order, f'cs_test_{index}', Action.CONFIRMED,
+                                    session_data=checkout_session(f'cs_test_{index}', f'pi_{index}',
+                                                                  f'buyer{index}@example.com'))
+        for index in range(3)
+    ]
+
+
+@pytest.mark.django_db
+def test_session_data_compact(payments):
+    payment = StripePayment.objects.get(pk=payments[0].pk)
+    assert payment.session_data == {
+        'id': 'cs_test_0',
+        'object': 'checkout.session',
+        'payment_intent': 'pi_0',
+        'payment_status': 'paid',
+        'customer_details': {'email': 'buyer0@example.com'},
+    }
+
+
+@pytest.mark.django_db
+def test_session_data_lookups(payments, django_assert_num_queries):
+    with django_assert_num_queries(2):
+        assert list(StripePayment.objects.for_payment_intent('pi_1')) == [payments[1]]
+        assert list(StripePayment.objects.for_customer_email('buyer2@example.com')) == [payments[2]]
+    assert list(StripePayment.objects.search('cs_test_0')) == [payments[0]]
+    assert StripePayment.objects.search('First') is None
+
+
+@pytest.mark.django_db
+def test_admin_search(client, settings, payments):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+    response = client.get(reverse('admin:shop_stripepayment_changelist'), {'q': 'pi_2'})
+    assert list(response.context['cl'].result_list) == [payments[2]]
+    response = client.get('/admin/shop/stripepayment/', {'q': 'buyer1@example.com'})
+    assert list(response.context['object_list']) == [payments[1]]
+
+
+def test_migrate_session_text():
+    migration = importlib.import_module('shop.migrations.0006_stripepayment_session_json')
+    assert migration.parse_session_data("{'id': 'cs_1', 'amount_total': 2500}") == {'id': 'cs_1', 'amount_total': 2500}
+    assert migration.parse_session_data('not a literal') == {'raw': 'not a literal'}
+    assert migration.parse_session_data(None) is None
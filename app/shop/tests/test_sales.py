@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from shop.models import Category, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, OrderStatus, \
+    Product
+from shop.sales import earliest_rebuild_day, rebuild_sales, sales_summary
+
+
+@pytest.fixture
+def products():
+    category = Category.objects.create(name='Sales')
+    return [Product.objects.create(category=category, code=f'SAL{index}', title=f'Sales {index}', price='2.50')
+            for index in range(2)]
+
+
+@pytest.fixture
+def place(products):
+    def place(quantities=(2, 1), paid=True):
+        order = Order.objects.create(first_name='First', last_name='Last', email='first@example.com',
+                                     address='1 Street', city='City', postal_code='3000', shipping='1.00',
+                                     tax='0.50', total_price=Decimal('2.50') * sum(quantities) + 1)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, price='2.50', quantity=quantity)
+                                       for product, quantity in zip(products, quantities) if quantity])
+        order.set_status(OrderStatus.PAYMENT_ACCEPT)
+        if paid:
+            order.paid_status = True
+            order.set_status(OrderStatus.PAYMENT_COMPLETE)
+        return order
+    return place
+
+
+def rollups():
+    return (
+        list(DailySales.objects.values_list('day', 'orders', 'units', 'revenue', 'tax', 'shipping')),
+        sorted(DailyProductSales.objects.values_list('day', 'product__code', 'units', 'revenue')),
+        sorted(DailyCategorySales.objects.values_list('day', 'category__name', 'units', 'revenue')),
+    )
+
+
+@pytest.mark.django_db
+def test_sales_recorded_when_paid(place):
+    place()
+    place(quantities=(0, 4))
+    place(paid=False)
+    today = timezone.localdate()
+    assert rollups() == (
+        [(today, 2, 7, Decimal('19.50'), Decimal('1.00'), Decimal('2.00'))],
+        [(today, 'SAL0', 2, Decimal('5.00')), (today, 'SAL1', 5, Decimal('12.50'))],
+        [(today, 'Sales', 7, Decimal('17.50'))],
+    )
+
+
+@pytest.mark.django_db
+def test_sale_recorded_once(place):
+    order = place()
+    # repeated notifications and later statuses leave the figures alone
+    order.set_status(OrderStatus.PAYMENT_COMPLETE)
+    order.set_status(OrderStatus.DISPATCHED)
+    assert DailySales.objects.get().orders == 1
+    assert DailyProductSales.objects.get(product__code='SAL0').units == 2
+
+
+@pytest.mark.django_db
+def test_rebuild_matches_recorded(place):
+    place()
+    place(quantities=(3, 0))
+    place(paid=False)
+    recorded = rollups()
+    DailySales.objects.update(orders=99)
+    DailyProductSales.objects.all().delete()
+
+    assert rebuild_sales() == 1
+    assert rollups() == recorded
+    # from a day onwards, earlier days are kept
+    yesterday = timezone.localdate() - timedelta(days=1)
+    DailySales.objects.create(day=yesterday, orders=3, units=3, revenue='9.00')
+    assert rebuild_sales(date_from=timezone.localdate()) == 1
+    assert DailySales.objects.filter(day=yesterday).exists()
+    assert rebuild_sales(date_from=timezone.localdate() + timedelta(days=1)) == 0
+    assert rollups()[0][-1][0] == yesterday
+
+
+@pytest.mark.django_db
+def test_rebuild_keeps_cancelled_sales(place):
+    place()
+    place(quantities=(1, 0)).set_status(OrderStatus.CANCELLED)
+    recorded = rollups()
+    assert recorded[0][0][1] == 2
+    rebuild_sales()
+    assert rollups() == recorded
+
+
+@pytest.mark.django_db
+def test_rebuild_keeps_archived_days(place, settings):
+    place()
+    settings.ORDER_ARCHIVE_DAYS = 30
+    archived = timezone.localdate() - timedelta(days=30)
+    DailySales.objects.create(day=archived, orders=3, units=3, revenue='9.00')
+    DailyProductSales.objects.create(day=archived, product=Product.objects.get(code='SAL0'), units=3,
+                                     revenue='7.50')
+    assert earliest_rebuild_day() == archived + timedelta(days=1)
+
+    assert rebuild_sales() == 1
+    assert rebuild_sales(date_from=archived - timedelta(days=5)) == 1
+    assert DailySales.objects.get(day=archived).orders == 3
+    assert DailyProductSales.objects.filter(day=archived).exists()
+
+
+@pytest.mark.django_db
+def test_rebuild_sales_command(place, capsys):
+    place()
+    DailySales.objects.all().delete()
+    call_command('rebuild_sales')
+    assert capsys.readouterr().out.startswith(f'Rebuilt 1 day of sales from {earliest_rebuild_day()} in ')
+    assert DailySales.objects.get().units == 3
+
+
+@pytest.mark.django_db
+def test_sales_summary(place):
+    place()
+    place(quantities=(0, 4))
+    summary = sales_summary(days=7, top=1)
+    assert summary['totals']['orders'] == 2
+    assert summary['totals']['revenue'] == Decimal('19.50')
+    assert summary['products'] == [{'product__code': 'SAL1', 'product__title': 'Sales 1', 'units': 5,
+                                    'revenue': Decimal('12.50')}]
+    assert summary['categories'][0]['category__name'] == 'Sales'
+
+
+@pytest.mark.django_db
+def test_sales_panel(client, settings, place):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    place()
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get('/admin/')
+    assert response.status_code == 200
+    assert b'Sales in the last 14 days' in response.content
+    assert b'SAL0 Sales 0' in response.content
+    # the dashboard reads the rollups, never the orders themselves
+    assert not [query['sql'] for query in queries if '"shop_order' in query['sql']]
+
+    client.force_login(User.objects.create_user('editor', 'editor@example.com', 'password', is_staff=True))
+    assert b'Sales in the last' not in client.get('/admin/').content
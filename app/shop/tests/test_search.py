@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shop.models import Category, Product
+from shop.search import search_products
+
+
+@pytest.fixture
+def catalog(settings):
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    settings.COMPRESS_ENABLED = False
+    cache.clear()
+    category = Category.objects.create(name='Search')
+    return {
+        code: Product.objects.create(category=category, code=code, title=title, detail=detail, price='1.00')
+        for code, title, detail in (
+            ('WILL', 'Estate kit', 'Everything needed to plan an estate'),
+            ('GUIDE', 'Funeral planning guide', 'A guide to planning a funeral, including your estate'),
+            ('CARD', 'Sympathy cards', 'A pack of ten cards'),
+        )
+    }
+
+
+@pytest.mark.django_db
+def test_search_ranked(catalog):
+    assert [p.code for p in Product.objects.search('estate')] == ['WILL', 'GUIDE']
+    assert [p.code for p in Product.objects.search('planning funeral')] == ['GUIDE']
+    assert [p.code for p in Product.objects.search('card')] == ['CARD']
+    assert not Product.objects.search('hearse').exists()
+
+
+@pytest.mark.django_db
+def test_search_vector_kept_current(catalog):
+    card = catalog['CARD']
+    card.title = 'Condolence cards'
+    card.save()
+    assert list(Product.objects.search('condolence')) == [card]
+
+    card.detail = 'Printed on recycled paper'
+    card.save(update_fields=['detail'])
+    assert list(Product.objects.search('recycled')) == [card]
+
+
+@pytest.mark.django_db
+def test_search_bulk_created(catalog):
+    Product.objects.bulk_create([Product(category_id=catalog['CARD'].category_id, code='URN', slug='urn',
+                                         title='Keepsake urn', price='1.00')])
+    assert not Product.objects.search('urn').exists()
+    Product.objects.filter(code='URN').update_search_vectors()
+    assert [p.code for p in Product.objects.search('urn')] == ['URN']
+
+
+@pytest.mark.django_db
+def test_search_pages_cached(catalog, settings, django_assert_num_queries):
+    settings.SHOP_SEARCH_PER_PAGE = 1
+    with django_assert_num_queries(1):
+        assert search_products('estate') == ([catalog['WILL'].id], True)
+    with django_assert_num_queries(0):
+        assert search_products('  ESTATE ') == ([catalog['WILL'].id], True)
+    assert search_products('estate', page=2) == ([catalog['GUIDE'].id], False)
+    assert search_products('') == ([], False)
+
+
+@pytest.mark.django_db
+def test_search_view(client, catalog):
+    response = client.get(reverse('product-search'), {'q': 'estate'})
+    assert response.status_code == 200
+    assert [p.code for p in response.context['products']] == ['WILL', 'GUIDE']
+    assert not response.context['has_next']
+
+    catalog['GUIDE'].available = False
+    catalog['GUIDE'].save()
+    # still left out while the cached page of ids has it
+    response = client.get(reverse('product-search'), {'q': 'estate'})
+    assert [p.code for p in response.context['products']] == ['WILL']
+    cache.clear()
+    response = client.get(reverse('product-search'), {'q': 'estate', 'page': 'x'})
+    assert [p.code for p in response.context['products']] == ['WILL']
+
+
+@pytest.mark.django_db
+def test_admin_search(client, catalog):
+    client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get('/admin/shop/product/', {'q': 'funeral'})
+    assert list(response.context['object_list']) == [catalog['GUIDE']]
+    assert any('@@' in query['sql'] for query in queries)
+    response = client.get(reverse('admin:shop_product_changelist'), {'q': 'cards'})
+    assert list(response.context['cl'].result_list) == [catalog['CARD']]
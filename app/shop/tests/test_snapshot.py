@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from shop.snapshot import CachedSnapshot
+
+
+class Builder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'build': self.calls}
+
+
+@pytest.fixture
+def builder():
+    return Builder()
+
+
+@pytest.fixture
+def snapshot(builder):
+    snapshot = CachedSnapshot('test_snapshot', builder)
+    snapshot.invalidate()
+    return snapshot
+
+
+def test_snapshot_built_once(snapshot, builder):
+    assert snapshot.get() == {'build': 1}
+    assert snapshot.get() == {'build': 1}
+    assert builder.calls == 1
+
+
+def test_snapshot_invalidate(snapshot, builder):
+    assert snapshot.get() == {'build': 1}
+    snapshot.invalidate()
+    assert snapshot.get() == {'build': 2}
+    assert builder.calls == 2
+
+
+def test_snapshot_shared_generation(snapshot, builder):
+    # another worker holding the same snapshot sees the invalidation
+    other = CachedSnapshot('test_snapshot', builder)
+    assert snapshot.get() == {'build': 1}
+    assert other.get() == {'build': 2}
+    other.invalidate()
+    assert snapshot.get() == {'build': 3}
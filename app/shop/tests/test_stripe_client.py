@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import stripe
+
+from shop import stripe_client
+
+
+class StubStripeHandler(BaseHTTPRequestHandler):
+    delay = 0
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        body = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.requests.append((self.path, body))
+        payload = json.dumps({
+            'id': f'cs_test_{len(self.server.requests)}',
+            'object': 'checkout.session',
+            'mode': body['mode'][0],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_stripe(settings, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubStripeHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.STRIPE_API_BASE = f'http://127.0.0.1:{server.server_port}'
+    settings.STRIPE_READ_TIMEOUT = 0.5
+    settings.STRIPE_MAX_RETRIES = 0
+    monkeypatch.setattr(stripe_client, '_http_client', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_create_checkout_session(stub_stripe):
+    session = stripe_client.create_checkout_session(mode='payment', payment_method_types=['card'])
+    assert session['id'] == 'cs_test_1'
+    session = stripe_client.create_checkout_session(mode='payment', payment_method_types=['card'])
+    assert session['id'] == 'cs_test_2'
+    assert [path for path, _ in stub_stripe.requests] == ['/v1/checkout/sessions'] * 2
+    # one pooled client for all calls
+    assert stripe.default_http_client is stripe_client.http_client()
+
+
+def test_acreate_checkout_session(stub_stripe):
+    session = asyncio.run(stripe_client.acreate_checkout_session(mode='payment'))
+    assert session['id'] == 'cs_test_1'
+
+
+def test_create_checkout_session_timeout(stub_stripe, monkeypatch):
+    monkeypatch.setattr(StubStripeHandler, 'delay', 1.0)
+    with pytest.raises(stripe.error.APIConnectionError):
+        stripe_client.create_checkout_session(mode='payment')
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from shop.models import Order, OrderStatus, StripePayment, StripeEvent, Action
+from shop.webhooks import process_events
+
+
+def signed(payload: str, secret: str):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def completed_event(event_id, session_id, amount_total=2500):
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'data': {
+            'object': {
+                'id': session_id,
+                'object': 'checkout.session',
+                'payment_status': 'paid',
+                'amount_total': amount_total,
+            }
+        }
+    }
+
+
+@pytest.fixture
+def order():
+    order = Order.objects.create(first_name='First', last_name='Last', email='first@example.com', address='1 Street',
+                                 city='City', postal_code='3000', shipping=0, tax=0, total_price='25.00')
+    order.set_status(OrderStatus.PAYMENT_ACCEPT)
+    StripePayment.record_action(order, 'cs_test_1', Action.CREATED)
+    return order
+
+
+@pytest.fixture
+def post_event(client, settings):
+    def post(event):
+        payload = json.dumps(event)
+        return client.post(reverse('stripe-webook'), payload, content_type='application/json',
+                           HTTP_STRIPE_SIGNATURE=signed(payload, settings.STRIPE_SIGNING_KEY))
+    return post
+
+
+@pytest.mark.django_db
+def test_webhook_records_event_once(post_event, order):
+    event = completed_event('evt_1', 'cs_test_1')
+    assert post_event(event).status_code == 200
+    assert post_event(event).status_code == 200
+    assert StripeEvent.objects.filter(event_id='evt_1').count() == 1
+    # acknowledged, not yet applied
+    order.refresh_from_db()
+    assert order.order_status == OrderStatus.PAYMENT_ACCEPT
+
+
+@pytest.mark.django_db
+def test_webhook_rejects_bad_signature(client, order):
+    response = client.post(reverse('stripe-webook'), json.dumps(completed_event('evt_1', 'cs_test_1')),
+                           content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=bad')
+    assert response.status_code == 406
+    assert not StripeEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_process_events(post_event, order):
+    post_event(completed_event('evt_1', 'cs_test_1'))
+    post_event({'id': 'evt_2', 'object': 'event', 'type': 'customer.created', 'data': {'object': {}}})
+    assert process_events() == (2, 2)
+
+    order.refresh_from_db()
+    assert order.paid_status
+    assert order.order_status == OrderStatus.PAYMENT_COMPLETE
+    confirmed = StripePayment.objects.get(order=order, milestone=Action.CONFIRMED)
+    assert str(confirmed.amount) == '25.00'
+    assert not StripeEvent.objects.filter(dt_processed__isnull=True).exists()
+
+    # a second event for the same session is applied without a duplicate payment record
+    post_event(completed_event('evt_3', 'cs_test_1'))
+    assert process_events() == (1, 1)
+    assert StripePayment.objects.filter(order=order, milestone=Action.CONFIRMED).count() == 1
+
+
+@pytest.mark.django_db
+def test_process_events_failure_retried(post_event):
+    post_event(completed_event('evt_1', 'cs_unknown'))
+    assert process_events() == (1, 0)
+    event = StripeEvent.objects.get(event_id='evt_1')
+    assert event.attempts == 1
+    assert 'cs_unknown' in event.error
+    assert event.dt_processed is None
+
+
+@pytest.mark.django_db
+def test_process_events_command_drains_past_failures(post_event, capsys):
+    post_event(completed_event('evt_0', 'cs_unknown'))
+    for index in range(1, 4):
+        post_event({'id': f'evt_{index}', 'object': 'event', 'type': 'customer.created', 'data': {'object': {}}})
+    call_command('process_stripe_events', batch_size=2)
+    assert capsys.readouterr().out.startswith('Applied 3 events in ')
+    assert list(StripeEvent.objects.filter(dt_processed__isnull=True).values_list('event_id', flat=True)) == ['evt_0']
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from  django.urls import path
-from . import views
+from . import api, views
 
 
 urlpatterns = [
@@ -11,12 +11,23 @@ urlpatterns = [
     path('cart/add/', views.cart_additem, name='cart-add'),
     path('cart/remove/', views.cart_removeitem, name='cart-remove'),
     path('cart/clear/', views.cart_clear, name='cart-clear'),
+    path('cart/summary/', views.cart_summary, name='cart-summary'),
+    path('csrf/', views.csrf_token, name='csrf-token'),
+    path('api/cart/', api.api_cart, name='api-cart'),
+    path('api/cart/add/', api.api_cart_add, name='api-cart-add'),
+    path('api/cart/remove/', api.api_cart_remove, name='api-cart-remove'),
+    path('api/cart/set/', api.api_cart_set, name='api-cart-set'),
+    path('api/cart/clear/', api.api_cart_clear, name='api-cart-clear'),
+    path('api/checkout/', api.api_checkout, name='api-checkout'),
     path('cart/order/', views.create_order, name='create-order'),
+    path('search/', views.ProductSearchView.as_view(), name='product-search'),
     path('category/<slug:slug>/', views.ProductListView.as_view(), name='product-category'),
-    path('<slug:slug>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('stripe-create-session', views.stripe_session, name='stripe-session'),
+    path('stripe-create-session-async', views.stripe_session_async, name='stripe-session-async'),
     path('stripe-success/<int:order_id>/<str:session_id>/', views.StripeSuccessView.as_view(), name='stripe-success'),
     path('stripe-cancelled/<int:order_id>/<str:session_id>/', views.StripeCancelView.as_view(), name='stripe-cancel'),
     path('stripe-notify/', views.stripe_webhook, name='stripe-webook'),
+    # catches any other single path segment, so keep it after the fixed paths
+    path('<slug:slug>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('', views.ProductListView.as_view(), name='products'),
 ]
@@ -1,26 +1,107 @@
 # -*- coding: utf-8 -*-
-from typing import Any
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import islice
+from typing import Any, Union
 from urllib.parse import urlsplit
 
 from django.http import HttpRequest
 
 
-def convert_to_str(data: Any):
-    """attempt to convert complex data to a string"""
-    if data is not None:
-        if isinstance(data, (str, int, float, bool)):
-            return data
-        if isinstance(data, list):
-            return [convert_to_str(d) for d in data]
-        if not isinstance(data, dict):
-            __type__ = data.__class__.__name__
-            data = vars(data)
-            data.update({'__type__': __type__})
-        return {convert_to_str(k): convert_to_str(v) for k, v in data.items()}
-    return data
+# the fields of stripe objects worth keeping, by their 'object' type
+STRIPE_FIELDS = {
+    'checkout.session': frozenset((
+        'id', 'object', 'amount_subtotal', 'amount_total', 'currency', 'client_reference_id', 'created',
+        'customer', 'customer_details', 'customer_email', 'expires_at', 'livemode', 'metadata', 'mode',
+        'payment_intent', 'payment_status', 'status', 'total_details',
+    )),
+    'payment_intent': frozenset((
+        'id', 'object', 'amount', 'amount_received', 'currency', 'created', 'customer', 'livemode',
+        'metadata', 'payment_method', 'receipt_email', 'status',
+    )),
+}
+
+CONVERT_MAX_DEPTH = 10
+CONVERT_MAX_ITEMS = 2000
+CONVERT_TRUNCATED = '...'
+CONVERT_CYCLE = '<cycle>'
+
+
+def convert_to_str(data: Any, max_depth: int = CONVERT_MAX_DEPTH, max_items: int = CONVERT_MAX_ITEMS,
+                   fields: dict = None, compact: bool = False):
+    """
+    attempt to convert complex data to a string
+
+    Works iteratively, so cost is bounded by max_items however large or deep
+    the data is. Containers nested deeper than max_depth and values beyond
+    max_items are replaced by '...', references back to an enclosing object
+    by '<cycle>', and stripe objects are reduced to their allowed fields.
+    With compact, null and empty values are left out of dicts.
+    """
+    fields = STRIPE_FIELDS if fields is None else fields
+    root = [None]
+    # (value, container the result goes into, key within it, depth, ids of the enclosing values)
+    stack = [(data, root, 0, 0, frozenset())]
+    budget = max_items - 1
+    while stack:
+        value, parent, key, depth, enclosing = stack.pop()
+        if compact and isinstance(parent, dict) and (value is None or value in ('', [], {})):
+            del parent[key]
+            continue
+        if value is None or isinstance(value, (str, int, float, bool)):
+            parent[key] = value
+            continue
+        if id(value) in enclosing:
+            parent[key] = CONVERT_CYCLE
+            continue
+        if depth >= max_depth or budget <= 0:
+            parent[key] = CONVERT_TRUNCATED
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            result, items = [], list(enumerate(islice(value, budget + 1)))
+        elif isinstance(value, dict) or hasattr(value, '__dict__'):
+            if isinstance(value, dict):
+                result, items = {}, value.items()
+                allowed = fields.get(value.get('object')) if isinstance(value.get('object'), str) else None
+                if allowed is not None:
+                    items = ((k, v) for k, v in items if k in allowed)
+            else:
+                result, items = {'__type__': value.__class__.__name__}, vars(value).items()
+            items = [(k if isinstance(k, (str, int, float, bool)) else str(k), v)
+                     for k, v in islice(items, budget + 1)]
+        else:
+            parent[key] = str(value)
+            continue
+        truncated, items = len(items) > budget, items[:budget]
+        if isinstance(result, list):
+            result.extend([None] * len(items) + ([CONVERT_TRUNCATED] if truncated else []))
+        else:
+            result.update((k, None) for k, _ in items)
+            if truncated:
+                result[CONVERT_TRUNCATED] = CONVERT_TRUNCATED
+        parent[key] = result
+        budget -= len(items)
+        enclosing = enclosing | {id(value)}
+        for k, v in items:
+            stack.append((v, result, k, depth + 1, enclosing))
+    return root[0]
+
+
+def session_exists(session) -> bool:
+    """check for an established session without loading or creating one"""
+    return getattr(session, 'session_key', None) is not None or session.modified
 
 
 def get_current_url(request: HttpRequest):
     """build the current url from a Django request"""
     url = f"{request.scheme}://{request.get_host()}{request.path}"
     return [e for e in urlsplit(url)] + ['']
+
+
+def to_cents(amount: Union[Decimal, float, int, str]) -> int:
+    """convert a currency amount to an integer number of cents"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    """convert an integer number of cents to a currency amount"""
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
@@ -4,26 +4,38 @@ from urllib.parse import urlunparse
 
 from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
-from django.shortcuts import redirect, get_object_or_404
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_POST, require_GET
 from django.views.generic import ListView, DetailView, TemplateView, CreateView
 
 import stripe
-from stripe.error import SignatureVerificationError
+from asgiref.sync import sync_to_async
+from stripe.error import SignatureVerificationError, StripeError
 
-from .cart import Cart
+from .cart import get_cart, catalog_product, CartError
 from .forms import CartItemForm, OrderForm
-from .models import Product, Category, Order, OrderStatus, StripePayment, Action
+from .idempotency import Idempotency, new_key
+from .images import prefetch_renditions
+from .models import Product, Category, Order, OrderStatus, StripePayment, StripeEvent, Action
+from .pagination import KeysetPage
+from .search import normalize_query, search_products
+from .stripe_client import create_checkout_session, acreate_checkout_session
 
 __all__ = (
     'ProductListView',
     'ProductDetailView',
+    'ProductSearchView',
     'cart_additem',
     'cart_removeitem',
-    'cart_clear'
+    'cart_clear',
+    'cart_summary',
+    'csrf_token',
 )
 
 from .utils import get_current_url
@@ -31,39 +43,81 @@ from .utils import get_current_url
 
 class CategoryMixin:
 
+    @cached_property
+    def categories(self):
+        # the one categories query for the request
+        return list(Category.objects.all())
+
     # noinspection PyUnresolvedReferences
     def get_context_data(self, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
-        context['categories'] = Category.objects.all()
+        context['categories'] = self.categories
         return context
 
 
 class ProductListView(CategoryMixin, ListView):
     model = Product
     context_object_name = 'products'
+    template_name = 'shop/product_list.html'
+    LIST_FIELDS = ('id', 'category_id', 'code', 'title', 'slug', 'detail', 'image', 'price')
+
+    def get_queryset(self):
+        queryset = Product.objects.filter(available=True).only(*self.LIST_FIELDS)\
+            .select_related('image').prefetch_related(prefetch_renditions())
+        if self.category is not None:
+            queryset = queryset.filter(category_id=self.category.id)
+        # pages run by product code, after or before the code last seen
+        self.page = KeysetPage(queryset, 'code', settings.PRODUCTS_PER_PAGE,
+                               after=self.request.GET.get('after') or None,
+                               before=self.request.GET.get('before') or None)
+        return self.page.object_list
 
     def get_context_data(self, object_list=None, **kwargs):
         context = super().get_context_data(object_list=object_list, **kwargs)
         context['category'] = self.category
+        context['page'] = self.page
         return context
 
     # noinspection PyAttributeOutsideInit
     def get(self, request, slug=None, *args, **kwargs):
-        self.categories = Category.objects.all()
-        self.queryset = Product.objects.filter(available=True)
         self.category = None
         if slug:
-            try:
-                self.category = Category.objects.get(slug=slug)
-                self.queryset = self.queryset.filter(category=self.category)
-            except Category.DoesNotExist:
+            self.category = next((category for category in self.categories if category.slug == slug), None)
+            if self.category is None:
                 messages.warning(request, f"Unknown category '{slug}'")
         return super().get(request, *args, **kwargs)
 
 
+class ProductSearchView(CategoryMixin, TemplateView):
+    template_name = 'shop/search.html'
+
+    def get_page_number(self) -> int:
+        try:
+            page = int(self.request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        return min(max(page, 1), settings.SHOP_SEARCH_MAX_PAGES)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query, page = normalize_query(self.request.GET.get('q')), self.get_page_number()
+        ids, has_next = search_products(query, page)
+        products = Product.objects.filter(id__in=ids, available=True).only(*ProductListView.LIST_FIELDS)\
+            .select_related('image').prefetch_related(prefetch_renditions()).in_bulk(ids) if ids else {}
+        context.update(
+            query=query,
+            products=[products[pk] for pk in ids if pk in products],
+            page_number=page,
+            has_previous=page > 1,
+            has_next=has_next and page < settings.SHOP_SEARCH_MAX_PAGES,
+        )
+        return context
+
+
 class ProductDetailView(CategoryMixin, DetailView):
     model = Product
     context_object_name = 'product'
+    queryset = Product.objects.select_related('category', 'image').prefetch_related(prefetch_renditions())
 
     def get_object(self, queryset=None):
         slug = self.kwargs.get(self.slug_url_kwarg)
@@ -81,16 +135,39 @@ class CartView(CategoryMixin, TemplateView):
     template_name = 'shop/cart.html'
 
 
+def private_json(data: dict) -> JsonResponse:
+    response = JsonResponse(data)
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
+@require_GET
+def cart_summary(request):
+    """the per visitor part of every page, fetched by the page itself"""
+    return private_json(get_cart(request).summary())
+
+
+@require_GET
+def csrf_token(request):
+    """a csrf token for forms in pages that are otherwise the same for every visitor"""
+    return private_json({'token': get_token(request)})
+
+
 @require_POST
 def cart_additem(request):
     form = CartItemForm(request.POST)
     if form.is_valid():
         product_code = form.cleaned_data['product_code']
         product_quantity = form.cleaned_data.get('product_quantity', 1) or 1
-        cart = Cart(request)
-        product = get_object_or_404(Product, code=product_code)
-        cart.add(product, quantity=product_quantity)
-        messages.info(request, f'{product.code} {product.title} ({product_quantity}) added to cart.')
+        cart = get_cart(request)
+        product = catalog_product(product_code)
+        if product is None:
+            raise Http404('No such product')
+        try:
+            cart.add(product, quantity=product_quantity)
+            messages.info(request, f'{product.code} {product.title} ({product_quantity}) added to cart.')
+        except CartError as e:
+            messages.error(request, f'{e}')
     else:
         messages.error(request, form.errors)
     return_url = request.POST.get('next', reverse('products'))
@@ -102,10 +179,13 @@ def cart_removeitem(request):
     form = CartItemForm(request.POST)
     if form.is_valid():
         product_code, product_quantity = form.cleaned_data['product_code'], form.cleaned_data['product_quantity']
-        cart = Cart(request)
-        product = get_object_or_404(Product, code=product_code)
-        cart.remove(product, quantity=product_quantity)
-        messages.info(request, f'{product.code} {product.title} ({product_quantity}) removed from cart.')
+        cart = get_cart(request)
+        if product_code in cart.cart:
+            # by code alone, so products since deleted from the catalog can still be removed
+            product = catalog_product(product_code, available=False)
+            cart.remove(Product(code=product_code), quantity=product_quantity)
+            description = product_code if product is None else f'{product.code} {product.title}'
+            messages.info(request, f'{description} ({product_quantity}) removed from cart.')
     else:
         messages.error(request, form.errors)
     return_url = request.POST.get('next', reverse('cart'))
@@ -114,7 +194,7 @@ def cart_removeitem(request):
 
 @require_POST
 def cart_clear(request):
-    Cart(request).clear()
+    get_cart(request).clear()
     messages.info(request, 'All products removed from your shopping cart.')
     return_url = request.POST.get('next', reverse('products'))
     return redirect(to=return_url)
@@ -122,7 +202,7 @@ def cart_clear(request):
 
 @require_POST
 def create_order(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if len(cart) < 1:
         messages.error(request, 'There are no products in your shopping cart.')
         return_url = request.POST.get('next', reverse('products'))
@@ -147,26 +227,42 @@ class OrderView(CreateView):
 
     def dispatch(self, request, *args, **kwargs):
         # noinspection PyAttributeOutsideInit
-        self.cart = Cart(request)
+        self.cart = get_cart(request)
         return super().dispatch(request, *args, **kwargs)
 
+    def post(self, request, *args, **kwargs):
+        """a repeated submission of the same form is redirected to the order it created"""
+        return Idempotency(request, 'order').respond(
+            lambda: super(OrderView, self).post(request, *args, **kwargs),
+            keep=lambda response: self.object is not None
+        )
+
 
 class OrderDetailView(DetailView):
+    """
+    query budget: two, the order then its items with their products
+    """
     template_name = 'shop/order_detail.html'
     model = Order
+    queryset = Order.objects.with_items()
     context_object_name = 'order'
     pk_url_kwarg = 'orderid'
 
 
 class PaymentView(DetailView):
+    """
+    query budget: two, the order then its items with their products
+    """
     template_name = 'shop/payment.html'
     model = Order
+    queryset = Order.objects.with_items()
     context_object_name = 'order'
     pk_url_kwarg = 'orderid'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['stripe_public_key'] = settings.STRIPE_PUBLIC_KEY
+        context['idempotency_key'] = new_key()
         return context
 
     def get(self, request, orderid=None, *args, **kwargs):
@@ -219,52 +315,75 @@ def stripe_callback_url(request, responsetype, order_id):
     return urlunparse(url).replace('%7B', '{').replace('%7D', '}')      # remove urlencoding
 
 
-def stripe_session(request):
-    """ajax handler"""
-    if request.method == 'POST':
-        # default return
-        try:
-            orderid, amount = int(request.POST['orderid']), str(request.POST['order_amount'])
-            order: Order = Order.objects.get(pk=orderid)
-            if Decimal(order.total_price) == Decimal(amount):
-                """
-                seems in order, create a checkout session
-                """
-                line_items = [
-                    dict(name=item.product.title, quantity=item.quantity, amount=int(item.price*100), currency=CURRENCY)
-                    for item in order.items.all()
-                ]
-                if order.shipping:
-                    line_items.append(dict(name='Shipping and handling', quantity=1,
-                                           amount=int(order.shipping*100), currency=CURRENCY))
-                if order.tax:
-                    line_items.append(dict(name='GST', quantity=1,
-                                           amount=int(order.tax*100), currency=CURRENCY))
-                stripe.api_key = settings.STRIPE_PRIVATE_KEY
-                checkout_session = stripe.checkout.Session.create(
-                    success_url=stripe_callback_url(request, 'stripe-success', orderid),
-                    cancel_url=stripe_callback_url(request, 'stripe-cancel', orderid),
-                    payment_method_types=['card'],
-                    mode='payment',
-                    line_items=line_items
-                )
-                order.set_status(OrderStatus.PAYMENT_ACCEPT)
-                StripePayment.record_action(order, checkout_session['id'], Action.CREATED,
-                                            session_data=checkout_session)
-                return JsonResponse({
-                    'status': 'true',
-                    'sessionId': checkout_session['id']
-                })
-
-        except (Order.DoesNotExist, KeyError):
-            pass
-        return JsonResponse({
-                'status': 'false',
-                'message': 'invalid or obsolete information provided'
-            },
-            status=HTTPStatus.BAD_REQUEST,
-            content_type=APPLICATION_PROBLEM_JSON,
-        )
+def checkout_order(request):
+    """the order named in a stripe session request, provided it matches the amount being paid"""
+    orderid, amount = int(request.POST['orderid']), str(request.POST['order_amount'])
+    # with the items and products the checkout line items are built from
+    order: Order = Order.objects.with_items().get(pk=orderid)
+    return order if Decimal(order.total_price) == Decimal(amount) else None
+
+
+def checkout_session_params(request, order: Order):
+    line_items = [
+        dict(name=item.product.title, quantity=item.quantity, amount=int(item.price*100), currency=CURRENCY)
+        for item in order.items.all()
+    ]
+    if order.shipping:
+        line_items.append(dict(name='Shipping and handling', quantity=1,
+                               amount=int(order.shipping*100), currency=CURRENCY))
+    if order.tax:
+        line_items.append(dict(name='GST', quantity=1,
+                               amount=int(order.tax*100), currency=CURRENCY))
+    return dict(
+        success_url=stripe_callback_url(request, 'stripe-success', order.id),
+        cancel_url=stripe_callback_url(request, 'stripe-cancel', order.id),
+        payment_method_types=['card'],
+        mode='payment',
+        line_items=line_items
+    )
+
+
+def checkout_started(order: Order, checkout_session):
+    order.set_status(OrderStatus.PAYMENT_ACCEPT)
+    StripePayment.record_action(order, checkout_session['id'], Action.CREATED,
+                                session_data=checkout_session)
+    return JsonResponse({
+        'status': 'true',
+        'sessionId': checkout_session['id']
+    })
+
+
+def stripe_session_invalid():
+    return JsonResponse({
+            'status': 'false',
+            'message': 'invalid or obsolete information provided'
+        },
+        status=HTTPStatus.BAD_REQUEST,
+        content_type=APPLICATION_PROBLEM_JSON,
+    )
+
+
+def stripe_session_unavailable(e: StripeError):
+    return JsonResponse({
+            'status': 'false',
+            'message': f'payment service unavailable: {e.user_message or e.__class__.__name__}'
+        },
+        status=HTTPStatus.BAD_GATEWAY,
+        content_type=APPLICATION_PROBLEM_JSON,
+    )
+
+
+def stripe_session_in_progress():
+    return JsonResponse({
+            'status': 'false',
+            'message': 'payment is already being arranged'
+        },
+        status=HTTPStatus.CONFLICT,
+        content_type=APPLICATION_PROBLEM_JSON,
+    )
+
+
+def stripe_session_unsupported(request):
     return JsonResponse({
             'status': 'false',
             'message': f'unsupported method {request.method}'
@@ -274,12 +393,79 @@ def stripe_session(request):
     )
 
 
+def stripe_session(request):
+    """
+    ajax handler
+
+    query budget: four, the order and its items with their products, then the status update and payment record;
+    a repeat carrying the same idempotency key is answered from the cache with no queries
+    """
+    if request.method == 'POST':
+        idempotency = Idempotency(request, 'stripe-session')
+        return idempotency.respond(lambda: start_checkout(request, idempotency), conflict=stripe_session_in_progress)
+    return stripe_session_unsupported(request)
+
+
+def start_checkout(request, idempotency: Idempotency):
+    try:
+        order = checkout_order(request)
+        if order:
+            """
+            seems in order, create a checkout session
+            """
+            checkout_session = create_checkout_session(
+                idempotency_key=idempotency.derived(f'checkout-{order.id}'),
+                **checkout_session_params(request, order)
+            )
+            return checkout_started(order, checkout_session)
+    except (Order.DoesNotExist, KeyError, ValueError):
+        pass
+    except StripeError as e:
+        return stripe_session_unavailable(e)
+    return stripe_session_invalid()
+
+
+async def stripe_session_async(request):
+    """ajax handler, the stripe round trip does not hold a worker when served via asgi"""
+    if request.method == 'POST':
+        idempotency = Idempotency(request, 'stripe-session')
+        replayed = await sync_to_async(idempotency.claim, thread_sensitive=False)(stripe_session_in_progress)
+        if replayed is not None:
+            return replayed
+        try:
+            response = await start_checkout_async(request, idempotency)
+        except BaseException:
+            await sync_to_async(idempotency.release)()
+            raise
+        return await sync_to_async(idempotency.finish)(response, keep=response.status_code < 400)
+    return stripe_session_unsupported(request)
+
+
+async def start_checkout_async(request, idempotency: Idempotency):
+    try:
+        order = await sync_to_async(checkout_order)(request)
+        if order:
+            params = await sync_to_async(checkout_session_params)(request, order)
+            checkout_session = await acreate_checkout_session(
+                idempotency_key=idempotency.derived(f'checkout-{order.id}'), **params
+            )
+            return await sync_to_async(checkout_started)(order, checkout_session)
+    except (Order.DoesNotExist, KeyError, ValueError):
+        pass
+    except StripeError as e:
+        return stripe_session_unavailable(e)
+    return stripe_session_invalid()
+
+
 @csrf_exempt
 def stripe_webhook(request):
-    stripe.api_key = settings.STRIPE_PRIVATE_KEY
-    endpoint_secret = settings.STRIPE_ENDPOINT_SECRET
+    """
+    record verified events and acknowledge them at once,
+    they are applied to orders by the process_stripe_events command
+    """
+    endpoint_secret = settings.STRIPE_SIGNING_KEY
     payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
     try:
         # Check the received data including signature
@@ -299,10 +485,8 @@ def stripe_webhook(request):
             'message': f'{e}'
          }, status=HTTPStatus.NOT_ACCEPTABLE)
 
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        print("Payment was successful.")
-        # TODO: run some custom code here
+    # stripe retries deliver the same event id, which is recorded only once
+    StripeEvent.receive(event.to_dict_recursive())
 
     return JsonResponse({
             'status': 'true',
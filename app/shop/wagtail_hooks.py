@@ -2,14 +2,33 @@
 from django.templatetags.static import static
 from django.utils.html import format_html
 
+from wagtail.admin.ui.components import Component
 from wagtail.core import hooks
 
+from .sales import sales_summary
+
 @hooks.register("insert_global_admin_css", order=100)
 def global_admin_css():
     """Add /static/css/admin.css to the admin."""
     return format_html('<link rel="stylesheet" href="{}">', static("scss/admin.css"))
 
 
+class SalesPanel(Component):
+    """recent sales on the admin dashboard, read from the daily rollups rather than the orders"""
+    name = 'shop_sales'
+    template_name = 'shop/admin/sales_panel.html'
+    order = 150
+
+    def get_context_data(self, parent_context):
+        return sales_summary()
+
+
+@hooks.register('construct_homepage_panels')
+def add_sales_panel(request, panels):
+    if request.user.has_perm('shop.view_order'):
+        panels.append(SalesPanel())
+
+
 # @hooks.register("insert_global_admin_js", order=100)
 # def global_admin_js():
 #     """Add /static/css/custom.js to the admin."""
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Apply received stripe webhook events to orders
+"""
+from datetime import datetime
+from typing import NamedTuple
+
+from dateutil.tz import tzlocal
+from django.db import transaction
+
+from .models import Order, OrderStatus, StripePayment, StripeEvent, Action
+from .utils import from_cents
+
+__all__ = (
+    'Processed',
+    'process_events',
+)
+
+
+def checkout_completed(payload: dict):
+    session = payload['data']['object']
+    if session.get('payment_status') != 'paid':
+        # delayed payment methods follow up with checkout.session.async_payment_succeeded
+        return
+    session_id = session['id']
+    payments = StripePayment.objects.filter(session_id=session_id)
+    if payments.filter(milestone=Action.CONFIRMED).exists():
+        return
+    created = payments.filter(milestone=Action.CREATED).select_related('order').first()
+    if created is None:
+        raise ValueError(f'no payment recorded for session {session_id}')
+    order: Order = created.order
+    order.paid_status = True
+    order.set_status(OrderStatus.PAYMENT_COMPLETE)
+    amount = from_cents(session['amount_total']) if session.get('amount_total') is not None else None
+    StripePayment.record_action(order, session_id, Action.CONFIRMED, amount=amount, session_data=session)
+
+
+HANDLERS = {
+    'checkout.session.completed': checkout_completed,
+    'checkout.session.async_payment_succeeded': checkout_completed,
+}
+
+
+class Processed(NamedTuple):
+    handled: int
+    applied: int
+
+    @property
+    def failed(self) -> int:
+        return self.handled - self.applied
+
+
+def process_events(batch_size=100) -> Processed:
+    """
+    apply one batch of pending events, returning the numbers handled and applied
+
+    Rows are locked with skip locked, so several consumers may run at once.
+    A failing event is retried on later batches up to StripeEvent.MAX_ATTEMPTS,
+    after events that have been tried fewer times, so it never holds them up.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects
+            .filter(dt_processed__isnull=True, attempts__lt=StripeEvent.MAX_ATTEMPTS)
+            .select_for_update(skip_locked=True)
+            .order_by('attempts', 'dt_received')[:batch_size]
+        )
+        applied = 0
+        for event in events:
+            handler = HANDLERS.get(event.event_type)
+            try:
+                if handler:
+                    with transaction.atomic():
+                        handler(event.payload)
+                event.dt_processed = datetime.now(tz=tzlocal())
+                event.error = ''
+                applied += 1
+            except Exception as e:
+                event.attempts += 1
+                event.error = f'{e.__class__.__name__}: {e}'
+        StripeEvent.objects.bulk_update(events, ('dt_processed', 'attempts', 'error'))
+    return Processed(len(events), applied)
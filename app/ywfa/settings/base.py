@@ -61,6 +61,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -84,6 +85,7 @@ INSTALLED_APPS = LOCAL_APPS + \
 
 MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'shop.middleware.CartMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -129,7 +131,8 @@ DATABASES = {
     'default': env.database_url(),
 }
 
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# cookie first, so rendering pages without messages never touches the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
 MESSAGE_TAGS = {
     messages.DEBUG: 'alert-info',
     messages.INFO: 'alert-info',
@@ -239,12 +242,42 @@ COMPRESS_FILTERS = {
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+PRODUCTS_PER_PAGE = env.int('PRODUCTS_PER_PAGE', 24)
+# product search, the text search configuration, results per page and seconds results are cached
+SHOP_SEARCH_CONFIG = env.get('SHOP_SEARCH_CONFIG', 'english')
+SHOP_SEARCH_PER_PAGE = env.int('SHOP_SEARCH_PER_PAGE', 24)
+SHOP_SEARCH_MAX_PAGES = 20
+SHOP_SEARCH_CACHE_TTL = env.int('SHOP_SEARCH_CACHE_TTL', 60)
+# rendition widths offered to browsers for product images, each as webp and the original format
+PRODUCT_IMAGE_WIDTHS = (320, 480, 640, 960)
+
 CART_SESSION_ID = '_ywfa_cart'
 ORDER_SESSION_ID = '_ywfa_order'
+# visitors get no session until they first add something to the cart
+CART_DEFER_SESSION = env.bool('CART_DEFER_SESSION', True)
+# where carts are kept, shop.cart.RedisCartStore keeps them in a redis hash per session on this cache
+# and shop.cart.CookieCartStore in a signed cookie, kept for this many seconds
+CART_STORE = env.get('CART_STORE', 'shop.cart.SessionCartStore')
+CART_REDIS_ALIAS = env.get('CART_REDIS_ALIAS', 'default')
+CART_COOKIE_NAME = 'ywfa_cart'
+CART_COOKIE_AGE = env.int('CART_COOKIE_AGE', 14 * 24 * 3600)
+# order and payment submissions repeating an idempotency key within this many seconds replay the first response,
+# waiting up to IDEMPOTENCY_WAIT seconds for it while the first is still being handled
+IDEMPOTENCY_TTL = env.int('IDEMPOTENCY_TTL', 3600)
+IDEMPOTENCY_WAIT = env.float('IDEMPOTENCY_WAIT', 10.0)
+# settled orders older than this are moved to compressed files by archive_orders
+ORDER_ARCHIVE_DAYS = env.int('ORDER_ARCHIVE_DAYS', 730)
+ORDER_ARCHIVE_DIR = env.get('ORDER_ARCHIVE_DIR', str(DJANGO_ROOT / 'archive'))
 
 STRIPE_PUBLIC_KEY = env['STRIPE_PUBLIC_KEY']
 STRIPE_PRIVATE_KEY = env['STRIPE_PRIVATE_KEY']
 STRIPE_SIGNING_KEY = env['STRIPE_SIGNING_KEY']
+# stripe http client, a local stub server may be substituted for the api
+STRIPE_API_BASE = env.get('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_CONNECT_TIMEOUT = env.float('STRIPE_CONNECT_TIMEOUT', 3.05)
+STRIPE_READ_TIMEOUT = env.float('STRIPE_READ_TIMEOUT', 20.0)
+STRIPE_POOL_SIZE = env.int('STRIPE_POOL_SIZE', 10)
+STRIPE_MAX_RETRIES = env.int('STRIPE_MAX_RETRIES', 1)
 
 
 # media files handling